@@ -3,7 +3,15 @@
     Class Tune -- contains subroutines to deal with tuning
 """
 from os.path import isfile, splitext
-import re
+
+from elements import atomic_number
+from tracer import TRACER
+from tune_parser import load
+
+# Grid steps: (half width around the previous optimum, spacing), base grids
+#  span the whole range
+OMEGA_STEPS = {"base": (None, 0.05), "coarse": (0.05, 0.01), "fine": (0.01, 0.001)}
+ALPHA_STEPS = {"base": (None, 0.1), "coarse": (0.1, 0.05)}
 
 
 class Tune:
@@ -34,153 +42,16 @@ class Tune:
         else:
             self.name, self.program = splitext(filename)
 
-        # We will loop through the file using a generator
-        #  need access to 'next' function
-        with open(filename, "r") as f:
-            f_gen = (x for x in f)
-            for i in f_gen:
-                # line contains lowercase white space removed string
-                # key splits line with space and { character
-                line = i.strip().lower()
-                key = re.split(" |{", line)
-
-                # Deal with empty lines and commented lines
-                if line == "" or line[0] == "#":
-                    pass
-
-                # charge line
-                elif key[0] == "charge":
-                    spl = re.split(" ", line)
-                    if len(spl) != 2:
-                        raise Exception(
-                            "Charge Keyword Error: See documentation for charge definition"
-                        )
-                    else:
-                        self.charge = spl[-1]
-
-                #  geometry block
-                elif key[0] == "geometry":
-                    # use 'next()' to traverse until we find end }
-                    self.geometry["geometry"] = []
-                    self.geometry["options"] = []
-                    line = next(f_gen).strip().lower()
-                    while True:
-                        spl = line.split()
-                        if line == "" or line[0] == "#":
-                            line = next(f_gen).strip().lower()
-                        elif line[0] == "}":
-                            break
-                        else:
-                            # Check to see if any options are actually specified
-                            if spl[0] == "option" and len(spl) <= 1:
-                                raise Exception(
-                                    'Geometry Block Keyword Error: See documentation for "option" keyword'
-                                )
-                            elif spl[0] == "option":
-                                self.geometry["option"] = spl[1:]
-                            else:
-                                # Check to see if there is actually an atomic vector here
-                                try:
-                                    [float(x) for x in spl[1:4]]
-                                    self.geometry["geometry"].append(line)
-                                except ValueError:
-                                    raise Exception(
-                                        "Geometry Block Error: Expected atomic vector on line -- {0}".format(
-                                            line
-                                        )
-                                    )
-                            line = next(f_gen).strip()
-
-                #  basis block
-                elif key[0] == "basis":
-                    # use 'next()' to traverse until we find end }
-                    self.basis["basis"] = []
-                    self.basis["option"] = []
-                    line = next(f_gen).strip().lower()
-                    while True:
-                        spl = re.split(" ", line)
-                        if line == "":
-                            line = next(f_gen).strip()
-                        elif line[0] == "}":
-                            break
-                        else:
-                            if spl[0] == "option" and len(spl) != 2:
-                                raise Exception(
-                                    'Basis Block Keyword Error: See documentation for "option" keyword'
-                                )
-                            elif spl[0] == "option":
-                                if spl[1] not in ["global", "specific", "generic"]:
-                                    raise Exception(
-                                        "Basis Block Keyword Error: {0} is not an available option, see documentation".format(
-                                            spl[1]
-                                        )
-                                    )
-                                self.basis["option"] = spl[1]
-                            else:
-                                self.basis["basis"].append(line)
-                            line = next(f_gen).strip()
-
-                #  ecp block which we will put in the
-                elif key[0] == "ecp":
-                    # use 'next()' to traverse until we find end }
-                    self.ecp["ecp"] = []
-                    self.ecp["option"] = []
-                    line = next(f_gen).strip().lower()
-                    while True:
-                        spl = re.split(" ", line)
-                        if line == "":
-                            line = next(f_gen).strip()
-                        elif line[0] == "}":
-                            break
-                        else:
-                            if spl[0] == "option" and len(spl) != 2:
-                                raise Exception(
-                                    'ECP Block Keyword Error: See documentation for "option" keyword'
-                                )
-                            elif spl[0] == "option":
-                                if spl[1] not in ["global", "specific", "generic"]:
-                                    raise Exception(
-                                        "ECP Block Keyword Error: {0} is not an available option, see documentation".format(
-                                            spl[1]
-                                        )
-                                    )
-                                self.ecp["option"] = spl[1]
-                            else:
-                                self.ecp["ecp"].append(line)
-                            line = next(f_gen).strip()
-
-                # dft block
-                #  Only non standard stuff here, therefore any input check doesn't make sense
-                elif key[0] == "dft":
-                    # use 'next()' to traverse until we find end }
-                    line = next(f_gen).strip().lower()
-                    while True:
-                        if line == "" or line[0] == "#":
-                            line = next(f_gen).strip()
-                        elif line[0] == "}":
-                            break
-                        else:
-                            self.dft.append(line)
-                            line = next(f_gen).strip()
-
-                # tune block
-                elif key[0] == "tune":
-                    # use 'next()' to traverse until we find end }
-                    line = next(f_gen).strip().lower()
-                    while True:
-                        if line == "" or line[0] == "#":
-                            line = next(f_gen).strip()
-                        elif line[0] == "}":
-                            break
-                        else:
-                            spl = line.split()
-                            if len(spl) != 2:
-                                raise Exception(
-                                    "Tune Block Error: this block can only contain key value pairs, see documentation"
-                                )
-                            else:
-                                self.tune[spl[0]] = spl[1]
-                            line = next(f_gen).strip()
+        # A single pass over the file (or its compiled form) gives us every
+        #  block, see tune_parser
+        with TRACER.span("parse", input=filename):
+            parsed = load(filename)
+        self.charge = parsed["charge"]
+        self.geometry = parsed["geometry"]
+        self.basis = parsed["basis"]
+        self.ecp = parsed["ecp"]
+        self.dft = parsed["dft"]
+        self.tune = parsed["tune"]
 
         # Now that we have read our input file, let's run some checks!
         self.run_input_checks()
@@ -224,7 +95,7 @@ class Tune:
         #   a) Does tune even exist?
         #   b) Is there even a dimension key-value pair?
         #   c) If dimension == 1 is there also an alpha key, elif dim == 2 we will just
-        #       print a warning that we ignore the alpha key
+        #       print a warning that the base step ignores the alpha key
         #   d) Finally make sure they provide a valid step
         if not self.tune:
             raise Exception(
@@ -235,16 +106,177 @@ class Tune:
         if self.tune["dimension"] == "1":
             if "alpha" not in self.tune:
                 raise Exception("Tune Error: 1D tuning requires an alpha value")
-        if self.tune["dimension"] == "2":
+        if self.tune["dimension"] == "2" and self.tune.get("step") in ["base", "auto"]:
             if "alpha" in self.tune:
                 print("Tune Warning: 2D tuning detected, ignoring alpha value")
         if "step" not in self.tune:
             raise Exception("Tune Error: You need to provide a step!")
-        if self.tune["dimension"] == 1 and self.tune["step"] not in [
+        if self.tune["dimension"] == "1" and self.tune["step"] not in [
             "base",
             "coarse",
             "fine",
+            "optimize",
+            "auto",
         ]:
             raise Exception("Tune Error: Invalid step for 1D tuning!")
-        if self.tune["dimension"] == 2 and self.tune["step"] not in ["base", "coarse"]:
+        if self.tune["dimension"] == "2" and self.tune["step"] not in [
+            "base",
+            "coarse",
+            "optimize",
+            "auto",
+        ]:
             raise Exception("Tune Error: Invalid step for 2D tuning!")
+
+        # Check 4: --> Refinement steps <--
+        #   a) coarse and fine steps are centered on the omega found in the
+        #       previous step, 2D coarse also needs the previous alpha
+        #   b) every value we read has to be a number
+        if self.tune["step"] in ["coarse", "fine"]:
+            if "omega" not in self.tune:
+                raise Exception(
+                    "Tune Error: {0} step requires the omega from the previous step".format(
+                        self.tune["step"]
+                    )
+                )
+            if self.tune["dimension"] == "2" and "alpha" not in self.tune:
+                raise Exception(
+                    "Tune Error: 2D coarse step requires the alpha from the base step"
+                )
+        for key in [
+            "alpha",
+            "omega",
+            "alpha_min",
+            "alpha_max",
+            "omega_min",
+            "omega_max",
+            "tolerance",
+        ]:
+            if key in self.tune:
+                try:
+                    float(self.tune[key])
+                except ValueError:
+                    raise Exception(
+                        "Tune Error: {0} must be a number, not {1}".format(
+                            key, self.tune[key]
+                        )
+                    )
+
+        # Check 5: --> Optimize step <--
+        #   a) the omega (and alpha for 2D) bracket has to be a valid interval
+        #   b) the tolerance has to be positive
+        if self.tune["step"] == "optimize":
+            lower, upper = self.omega_bounds()
+            if not 0.0 < lower < upper:
+                raise Exception(
+                    "Tune Error: omega_min and omega_max must satisfy 0 < omega_min < omega_max"
+                )
+            lower, upper = self.alpha_bounds()
+            if self.tune["dimension"] == "2" and not 0.0 <= lower < upper <= 1.0:
+                raise Exception(
+                    "Tune Error: alpha_min and alpha_max must satisfy 0 <= alpha_min < alpha_max <= 1"
+                )
+            if self.tolerance() <= 0.0:
+                raise Exception("Tune Error: tolerance must be positive")
+
+    def omega_bounds(self):
+        """
+        Bracket (bohr^-1) searched by the optimize step
+        """
+        return (
+            float(self.tune.get("omega_min", 0.05)),
+            float(self.tune.get("omega_max", 1.00)),
+        )
+
+    def alpha_bounds(self):
+        """
+        Bracket of short range Hartree-Fock fractions searched by the 2D
+        optimize step
+        """
+        return (
+            float(self.tune.get("alpha_min", 0.0)),
+            float(self.tune.get("alpha_max", 1.0)),
+        )
+
+    def tolerance(self):
+        """
+        Absolute tolerance (bohr^-1) on the omega found by the optimize step
+        """
+        return float(self.tune.get("tolerance", 1e-3))
+
+    def omega_grid(self, step=None, center=None):
+        """
+        Omega values (bohr^-1) evaluated by a grid step, by default the
+        current step centered on the omega from the tune block
+        """
+        step = step or self.tune["step"]
+        width, spacing = OMEGA_STEPS[step]
+        if step == "base":
+            return _grid(spacing, 1.00, spacing)
+        if center is None:
+            center = float(self.tune["omega"])
+        return _grid(center - width, center + width, spacing)
+
+    def alpha_grid(self, step=None, center=None):
+        """
+        Short range Hartree-Fock fractions evaluated by a grid step
+        """
+        step = step or self.tune["step"]
+        if self.tune["dimension"] == "1":
+            return [float(self.tune["alpha"])]
+        width, spacing = ALPHA_STEPS[step]
+        if step == "base":
+            return _grid(0.0, 1.0, spacing, include_zero=True)
+        if center is None:
+            center = float(self.tune["alpha"])
+        return _grid(center - width, center + width, spacing, include_zero=True)
+
+    def grid(self, step=None, alpha=None, omega=None):
+        """
+        Every (alpha, omega) point evaluated by a grid step, by default the
+        current step centered on the values from the tune block
+        """
+        return [
+            (a, w)
+            for a in self.alpha_grid(step, alpha)
+            for w in self.omega_grid(step, omega)
+        ]
+
+    def spacing(self, step):
+        """
+        Grid spacing of a step, (alpha, omega), alpha is 0 in 1D
+        """
+        if self.tune["dimension"] == "1":
+            return 0.0, OMEGA_STEPS[step][1]
+        return ALPHA_STEPS[step][1], OMEGA_STEPS[step][1]
+
+    def grid_size(self):
+        """
+        Points evaluated by the full sequence of grid steps for this
+        dimension (base, coarse and, in 1D, fine), for comparison with the
+        optimize step
+        """
+        steps = ["base", "coarse", "fine"]
+        if self.tune["dimension"] == "2":
+            steps = ["base", "coarse"]
+        return sum(
+            len(self.alpha_grid(x, 0.5)) * len(self.omega_grid(x, 0.5)) for x in steps
+        )
+
+    def electrons(self, charge=None):
+        """
+        All electron count of the molecule, or of the job with total charge
+        """
+        if charge is None:
+            charge = self.charge
+        count = sum(atomic_number(x) for x in self.geometry["symbols"])
+        return count - int(charge)
+
+
+def _grid(start, stop, step, include_zero=False):
+    """
+    Evenly spaced values from start to stop (inclusive), clipped to [0, 1].
+    Omega has to stay strictly positive, alpha may be zero.
+    """
+    count = int(round((stop - start) / step)) + 1
+    values = [round(start + i * step, 6) for i in range(count)]
+    return [x for x in values if (x > 0.0 or include_zero and x == 0.0) and x <= 1.0]
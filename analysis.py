@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""
+    Analysis -- vectorized tuning function and a surrogate fit that locates
+    the optimum between the evaluated points
+
+    J is the norm of two residuals, r1 = e_homo(N) + IP(N) and
+    r2 = e_homo(N+1) + IP(N+1), which are smooth, nearly linear functions
+    of omega (and alpha). Each residual is fitted with a local quadratic
+    over the points closest to the best one, and the optimum is the
+    minimum of r1^2 + r2^2 of the fitted models (Gauss-Newton). Fitting
+    the residuals rather than J itself avoids the bias of a quadratic
+    model of J near its kink. The error of the optimum is the jackknife
+    standard error over the fitted points.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+# alpha_error is 0 for 1D tuning, where alpha is fixed
+Estimate = namedtuple(
+    "Estimate", ["alpha", "omega", "j", "alpha_error", "omega_error"]
+)
+
+# Points of the local fit
+WINDOW_1D = 6
+WINDOW_2D = 15
+
+
+def residual_values(results, jobs):
+    """
+    r1 and r2 for every point at once, jobs is a list of the (cation,
+    neutral, anion) jobs of each point as returned by point_jobs. Returns
+    an (n, 2) array.
+    """
+    energy = np.array([[results[x]["energy"] for x in point] for point in jobs])
+    homo = np.array([[results[x]["homo"] for x in point] for point in jobs])
+    energy = energy.reshape(-1, 3)
+    homo = homo.reshape(-1, 3)
+    ip_n = energy[:, 0] - energy[:, 1]
+    ip_n1 = energy[:, 1] - energy[:, 2]
+    return np.stack([homo[:, 1] + ip_n, homo[:, 2] + ip_n1], axis=1)
+
+
+# Local models of a residual in the scaled coordinates x (n, d), with the
+#  gradient of each column of the design matrix at a single point
+def _design(x, order):
+    columns = [np.ones(len(x))] + [x[:, i] for i in range(x.shape[1])]
+    if order == 2:
+        d = x.shape[1]
+        columns += [x[:, i] * x[:, k] for i in range(d) for k in range(i, d)]
+    return np.stack(columns, axis=1)
+
+
+def _design_gradient(x, order):
+    d = len(x)
+    rows = [np.zeros(d)] + [np.eye(d)[i] for i in range(d)]
+    if order == 2:
+        for i in range(d):
+            for k in range(i, d):
+                gradient = np.zeros(d)
+                gradient[i] += x[k]
+                gradient[k] += x[i]
+                rows.append(gradient)
+    return np.array(rows)
+
+
+def _columns(d, order):
+    return 1 + d + (d * (d + 1) // 2 if order == 2 else 0)
+
+
+def _minimize(coefficients, start, order, lower, upper):
+    """
+    Gauss-Newton minimum of r1^2 + r2^2 of the fitted residual models,
+    None if it doesn't converge inside the (padded) fitted region
+    """
+    x = np.array(start, dtype=float)
+    for _ in range(50):
+        design = _design(x[None, :], order)[0]
+        r = coefficients.T @ design
+        jacobian = coefficients.T @ _design_gradient(x, order)
+        step = np.linalg.lstsq(jacobian, -r, rcond=None)[0]
+        # halve the step until the sum of squares goes down
+        for _ in range(30):
+            trial = x + step
+            rt = coefficients.T @ _design(trial[None, :], order)[0]
+            if rt @ rt <= r @ r:
+                break
+            step = 0.5 * step
+        x = trial
+        if np.abs(step).max() < 1e-12:
+            break
+    span = upper - lower
+    if np.any(x < lower - 0.5 * span) or np.any(x > upper + 0.5 * span):
+        return None
+    return x
+
+
+def _solve(x, residuals, start, lower, upper):
+    """
+    Fit both residuals on the points x and minimize, quadratic models when
+    there are enough points for a jackknife, linear ones otherwise
+    """
+    for order in [2, 1]:
+        if len(x) > _columns(x.shape[1], order):
+            break
+    else:
+        return None
+    coefficients, _, rank, _ = np.linalg.lstsq(
+        _design(x, order), residuals, rcond=None
+    )
+    if rank < _columns(x.shape[1], order):
+        return None
+    return _minimize(coefficients, start, order, lower, upper)
+
+
+def _local_fit(x, residuals, size):
+    """
+    Minimum of the fitted model over the size points (rows of the scaled x)
+    closest to the best one, J there and the jackknife error of the
+    minimum. None if the fit has no minimum.
+    """
+    j = np.hypot(*residuals.T)
+    best = np.argmin(j)
+    keep = np.argsort(np.linalg.norm(x - x[best], axis=1), kind="stable")[:size]
+    u, r = x[keep], residuals[keep]
+    lower, upper = u.min(axis=0), u.max(axis=0)
+    found = _solve(u, r, x[best], lower, upper)
+    if found is None:
+        return None
+
+    # jackknife over the fitted points
+    minima = []
+    for i in range(len(u)):
+        mask = np.arange(len(u)) != i
+        other = _solve(u[mask], r[mask], found, lower, upper)
+        if other is None:
+            return None
+        minima.append(other)
+    minima = np.array(minima)
+    n = len(minima)
+    error = np.sqrt((n - 1.0) / n * ((minima - minima.mean(axis=0)) ** 2).sum(axis=0))
+
+    order = 2 if len(u) > _columns(u.shape[1], 2) else 1
+    coefficients = np.linalg.lstsq(_design(u, order), r, rcond=None)[0]
+    value = coefficients.T @ _design(found[None, :], order)[0]
+    return found, float(np.hypot(*value)), error
+
+
+def _estimate(points, residuals, size):
+    """
+    Scale the points to a unit box, fit and scale back
+    """
+    center = points.mean(axis=0)
+    scale = np.maximum(np.ptp(points, axis=0), 1e-12)
+    found = _local_fit((points - center) / scale, residuals, size)
+    if found is None:
+        return None
+    best, value, error = found
+    return center + scale * best, value, scale * error
+
+
+def fit_1d(omega, residuals):
+    """
+    Estimate of the omega minimizing J, from evaluated omegas and their
+    (r1, r2). None when the points don't pin down a minimum.
+    """
+    omega = np.asarray(omega, dtype=float)
+    if len(np.unique(omega)) < 3:
+        return None
+    found = _estimate(omega[:, None], np.asarray(residuals, dtype=float), WINDOW_1D)
+    if found is None:
+        return None
+    best, value, error = found
+    return Estimate(None, float(best[0]), value, 0.0, float(error[0]))
+
+
+def fit_2d(alpha, omega, residuals):
+    """
+    Estimate of the (alpha, omega) minimizing J, from evaluated points and
+    their (r1, r2). None when the points don't pin down a minimum.
+    """
+    points = np.stack(
+        [np.asarray(alpha, dtype=float), np.asarray(omega, dtype=float)], axis=1
+    )
+    if len(np.unique(points[:, 0])) < 3 or len(np.unique(points[:, 1])) < 3:
+        return None
+    found = _estimate(points, np.asarray(residuals, dtype=float), WINDOW_2D)
+    if found is None:
+        return None
+    (alpha, omega), value, (alpha_error, omega_error) = found
+    return Estimate(
+        float(alpha), float(omega), value, float(alpha_error), float(omega_error)
+    )
+
+
+def estimate(tune, residuals):
+    """
+    Surrogate optimum from a dictionary of (alpha, omega) -> (r1, r2) of
+    evaluated points, None if they don't pin it down
+    """
+    if len(residuals) < 3:
+        return None
+    points = np.array(list(residuals), dtype=float)
+    values = np.array(list(residuals.values()), dtype=float)
+    if tune.tune["dimension"] == "1":
+        found = fit_1d(points[:, 1], values)
+        return found and found._replace(alpha=float(tune.tune["alpha"]))
+    return fit_2d(points[:, 0], points[:, 1], values)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+    Batch -- tunes a library of molecules at once, every molecule feeds its
+    jobs into one shared JobExecutor, and reports on tuned molecules
+"""
+from glob import glob
+from os.path import dirname, isdir, isfile, join, normpath, splitext
+import threading
+
+from Tune import Tune
+from analysis import estimate
+from tuning import next_step, optimum, tune_molecule
+
+
+class BatchRunner:
+    """
+    Dispatches each job to the QMRunner of its molecule (Job.name)
+    """
+
+    def __init__(self, runners):
+        self.runners = {x.tune.name: x for x in runners}
+
+    def key(self, job):
+        return self.runners[job.name].key(job)
+
+    def cost(self, job):
+        return self.runners[job.name].cost(job)
+
+    def terminate(self, job):
+        self.runners[job.name].terminate(job)
+
+    def clean(self, job):
+        self.runners[job.name].clean(job)
+
+    def pack(self, jobs, guesses):
+        return self.runners[jobs[0].name].pack(jobs, guesses)
+
+    def __call__(self, job, guess=None):
+        return self.runners[job.name](job, guess)
+
+
+def read_input(filename):
+    if not isfile(filename) or splitext(filename)[-1] not in [
+        ".tune-nw",
+        ".tune-g09",
+    ]:
+        raise Exception(
+            (
+                "Input Error: {} doesn't exist or doesn't have the "
+                + "expected extension, try -h/--help"
+            ).format(filename)
+        )
+    return Tune(filename)
+
+
+def read_manifest(path):
+    """
+    Tune inputs listed by path, either a directory containing .tune-nw and
+    .tune-g09 files or a manifest with one input per line (relative to the
+    manifest, # starts a comment). Inputs that only differ by extension
+    would share their molecule's name, job directory and journal, and are
+    refused.
+    """
+    if isdir(path):
+        inputs = glob(join(path, "*.tune-nw")) + glob(join(path, "*.tune-g09"))
+        return _unique(sorted(normpath(x) for x in inputs))
+
+    inputs = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if line == "":
+                continue
+            if splitext(line)[-1] not in [".tune-nw", ".tune-g09"]:
+                raise Exception(
+                    "Manifest Error: {0} is not a .tune-nw or .tune-g09 file".format(
+                        line
+                    )
+                )
+            inputs.append(normpath(join(dirname(path), line)))
+    return _unique(inputs)
+
+
+def _unique(inputs):
+    names = {}
+    for x in inputs:
+        name = splitext(x)[0]
+        if name in names and names[name] == x:
+            raise Exception("Manifest Error: {0} is listed twice".format(x))
+        if name in names:
+            raise Exception(
+                "Manifest Error: {0} and {1} are the same molecule {2}".format(
+                    names[name], x, name
+                )
+            )
+        names[name] = x
+    return inputs
+
+
+def tune_all(tunes, executor, exhaustive=False, priors=None):
+    """
+    Run the requested step of every molecule concurrently, one thread per
+    molecule so optimize steps interleave with grid steps in the executor's
+    queue. With a PriorDatabase every molecule starts from the prior it
+    predicts and its optimum is recorded. Returns name -> list of (alpha,
+    omega, J), or the exception that stopped that molecule.
+    """
+    outcomes = {}
+
+    def work(tune):
+        try:
+            residuals = {}
+            prior = None if priors is None else priors.predict(tune)
+            outcomes[tune.name] = tune_molecule(
+                tune, executor, exhaustive, residuals, prior
+            )
+            if priors is not None:
+                found = estimate(tune, residuals)
+                priors.record(tune, *optimum(tune, residuals, found))
+        except Exception as e:
+            outcomes[tune.name] = e
+
+    threads = [threading.Thread(target=work, args=(x,), daemon=True) for x in tunes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def results_table(tunes, outcomes):
+    """
+    One line per molecule with its best point and the points evaluated
+    """
+    lines = [
+        "{0:<30} {1:>8} {2:>8} {3:>8} {4:>14} {5:>7}".format(
+            "molecule", "step", "alpha", "omega", "J", "points"
+        )
+    ]
+    for tune in tunes:
+        outcome = outcomes[tune.name]
+        if isinstance(outcome, Exception):
+            lines.append(
+                "{0:<30} {1:>8} failed: {2}".format(tune.name, tune.tune["step"], outcome)
+            )
+            continue
+        alpha, omega, j = min(outcome, key=lambda x: x[2])
+        lines.append(
+            "{0:<30} {1:>8} {2:8.4f} {3:8.4f} {4:14.8f} {5:7d}".format(
+                tune.name, tune.tune["step"], alpha, omega, j, len(outcome)
+            )
+        )
+    return lines
+
+
+def molecule_report(tune, points, residuals, found=None, prior=None):
+    """
+    Lines reporting the tuning of a single molecule: every point evaluated,
+    the best one, the surrogate optimum found from residuals and whether
+    another grid step could still improve on it
+    """
+    lines = []
+    if prior is not None and tune.tune["step"] in ["base", "auto", "optimize"]:
+        lines.append(prior_line(prior))
+    lines.append("{0:>8} {1:>8} {2:>14}".format("alpha", "omega", "J"))
+    for alpha, omega, j in points:
+        lines.append("{0:8.4f} {1:8.4f} {2:14.8f}".format(alpha, omega, j))
+    alpha, omega, j = min(points, key=lambda x: x[2])
+    lines.append(
+        "Best point: alpha {0:.4f} omega {1:.4f} J {2:.8f}".format(alpha, omega, j)
+    )
+    lines.append(
+        "Evaluations: {0} points, {1} QM jobs".format(len(points), 3 * len(points))
+    )
+    if tune.tune["step"] in ["optimize", "auto"]:
+        lines.append("Equivalent grid steps: {0} points".format(tune.grid_size()))
+    elif len(points) < len(tune.grid()):
+        lines.append(
+            "Skipped: {0} grid points outside the bracket".format(
+                len(tune.grid()) - len(points)
+            )
+        )
+
+    if found is not None:
+        lines.append(
+            "Surrogate optimum: alpha {0:.4f} +/- {1:.4f} omega {2:.4f} +/- {3:.4f} J {4:.8f}".format(
+                found.alpha, found.alpha_error, found.omega, found.omega_error, found.j
+            )
+        )
+    if tune.tune["step"] in ["base", "coarse", "fine"]:
+        following = next_step(tune, tune.tune["step"], found)
+        if following is None:
+            lines.append("Refinement: not needed")
+        else:
+            center = found or min(points, key=lambda x: x[2])
+            lines.append(
+                "Refinement: run step {0} around alpha {1:.4f} omega {2:.4f}".format(
+                    following, center[0], center[1]
+                )
+            )
+    return lines
+
+
+def prior_line(prior):
+    return "Prior: alpha {0.alpha:.4f} +/- {0.alpha_width:.4f} omega {0.omega:.4f} +/- {0.omega_width:.4f} from {0.count} tuned molecules".format(
+        prior
+    )
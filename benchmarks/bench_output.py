@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+""" bench_output.py -- Throughput of the QM output parser on synthetic logs
+Usage:
+    bench_output.py [options]
+
+Options:
+    -h, --help                  Print this screen and exit
+    -s, --size <GB>             Size of each synthetic log [default: 2]
+    -d, --directory <dir>       Where to write the logs [default: .]
+    -k, --keep                  Keep the logs instead of deleting them
+"""
+from os import remove
+from os.path import abspath, dirname, getsize, join
+import sys
+import time
+import tracemalloc
+
+from docopt import docopt
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from qm_output import read_output  # noqa: E402
+
+# Verbose DFT print repeated until the log has the requested size, the
+#  values we look for only appear at the end like in a real output
+NWCHEM_FILLER = "".join(
+    " d= 0,ls=0.0,diis {0:5d}    -76.{0:010d} -1.23D-0{1}  4.56D-05  7.89D-06    {0:4d}.0\n".format(
+        i, 1 + i % 8
+    )
+    + "          Grid integrated density:       9.999999999{0:03d}\n".format(i % 1000)
+    + "          Requested integration accuracy:   0.10E-07\n"
+    for i in range(2000)
+)
+NWCHEM_TAIL = """
+         Total DFT energy =      -76.401234567890
+                       DFT Final Molecular Orbital Analysis
+                       ------------------------------------
+ Vector    5  Occ=2.000000D+00  E=-3.151234D-01
+ Vector    6  Occ=0.000000D+00  E= 4.912345D-02
+"""
+GAUSSIAN_FILLER = "".join(
+    " Cycle {0:4d}  Pass 1  IDiag  1:\n".format(i)
+    + " E= -76.4012345{0:05d}     Delta-E=       -0.00000{0:05d} Rises=F Damp=F\n".format(
+        i
+    )
+    + " DIIS: error= 1.23D-0{0} at cycle {1} NSaved= 12.\n".format(1 + i % 8, i)
+    for i in range(2000)
+)
+GAUSSIAN_TAIL = """
+ SCF Done:  E(RLC-wPBE) =  -76.4012345678     A.U. after   14 cycles
+ Alpha  occ. eigenvalues --  -19.12345  -1.01234  -0.52345  -0.40123  -0.31512
+ Alpha virt. eigenvalues --    0.04912   0.12345
+"""
+
+
+def write_log(path, size, filler, tail):
+    with open(path, "w") as f:
+        written = 0
+        while written < size:
+            f.write(filler)
+            written += len(filler)
+        f.write(tail)
+
+
+def benchmark(path, program):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = read_output(path, program)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    size = getsize(path)
+    print(
+        "{0:<10} {1:8.2f} GB {2:8.2f} s {3:8.1f} MB/s {4:8.2f} MB peak heap  homo {5}".format(
+            program, size / 1e9, elapsed, size / 1e6 / elapsed, peak / 1e6, result["homo"]
+        )
+    )
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__)
+    size = int(float(arguments["--size"]) * 1e9)
+    for program, filler, tail in [
+        (".tune-nw", NWCHEM_FILLER, NWCHEM_TAIL),
+        (".tune-g09", GAUSSIAN_FILLER, GAUSSIAN_TAIL),
+    ]:
+        path = join(arguments["--directory"], "bench{0}.log".format(program))
+        write_log(path, size, filler, tail)
+        try:
+            benchmark(path, program)
+        finally:
+            if not arguments["--keep"]:
+                remove(path)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""
+    mock_qm.py -- deterministic stand-in for nwchem and g09
+
+    Called like nwchem (deck as the only argument) or like g09 (deck on
+    stdin), it writes an output that qm_output can parse to stdout and
+    leaves a movecs/chk file behind for warm starts. Packed decks, several
+    task dft sections or a --Link1-- chain, run every task in turn after a
+    single startup and stop at the first failure. An SCF capped below the
+    iterations it needs (NWChem iterations, Gaussian scf=maxcycle) fails to
+    converge, and the latency of an iteration shrinks with the cores of the
+    job (%nprocshared, or MOCK_QM_CORES set by the launcher) by Amdahl's law. Energies and eigenvalues
+    come from an analytic model of the n electron system,
+
+        E(n)      = -75 * atoms - 0.2 * n (+ 0.15 for odd n)
+        e_homo(n) = E(n) - E(n-1) + f(alpha, omega)
+
+    so J(alpha, omega) vanishes at (MOCK_QM_ALPHA, MOCK_QM_OMEGA), with
+    f = 0.30 dw + 0.10 da + 0.50 dw^2 for the closed shell (even n) and
+    f = 0.20 dw - 0.25 da for the anion (odd n).
+
+    Environment variables:
+        MOCK_QM_ALPHA, MOCK_QM_OMEGA    location of the optimum [0.2, 0.45]
+        MOCK_QM_LATENCY                 seconds per SCF iteration [0.0]
+        MOCK_QM_STARTUP                 seconds of program startup [0.0]
+        MOCK_QM_FAILURE                 fraction of jobs whose SCF stalls [0.0]
+        MOCK_QM_SEED                    seed of the failure draw [0]
+        MOCK_QM_VERBOSE                 filler lines printed per iteration [0]
+        MOCK_QM_PARALLEL                parallel fraction of an iteration [0.9]
+        MOCK_QM_CORES                   cores of an NWChem job [1]
+"""
+from hashlib import sha256
+from os import environ
+from os.path import abspath, dirname
+import re
+import sys
+import time
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+from elements import atomic_number  # noqa: E402
+
+ALPHA = float(environ.get("MOCK_QM_ALPHA", 0.2))
+OMEGA = float(environ.get("MOCK_QM_OMEGA", 0.45))
+LATENCY = float(environ.get("MOCK_QM_LATENCY", 0.0))
+STARTUP = float(environ.get("MOCK_QM_STARTUP", 0.0))
+FAILURE = float(environ.get("MOCK_QM_FAILURE", 0.0))
+SEED = environ.get("MOCK_QM_SEED", "0")
+VERBOSE = int(environ.get("MOCK_QM_VERBOSE", 0))
+PARALLEL = float(environ.get("MOCK_QM_PARALLEL", 0.9))
+CORES = int(environ.get("MOCK_QM_CORES", 1))
+
+COLD_ITERATIONS = 18
+WARM_ITERATIONS = 8
+STALLED_ITERATIONS = 100
+
+
+def energy(n, atoms):
+    return -75.0 * atoms - 0.2 * n + 0.15 * (n % 2)
+
+
+def homo(n, atoms, alpha, omega):
+    dw = omega - OMEGA
+    da = alpha - ALPHA
+    if n % 2 == 0:
+        f = 0.30 * dw + 0.10 * da + 0.50 * dw * dw
+    else:
+        f = 0.20 * dw - 0.25 * da
+    return energy(n, atoms) - energy(n - 1, atoms) + f
+
+
+def read_nwchem(deck):
+    """
+    One job per task dft section, charge carries over between sections
+    like in NWChem
+    """
+    geometry = re.search(r"^geometry.*?\n(.*?)^end", deck, re.M | re.S).group(1)
+    atoms = [x.split()[0] for x in geometry.splitlines() if len(x.split()) >= 4]
+    jobs = []
+    charge = 0
+    for section in re.split(r"^task dft.*$", deck, flags=re.M)[:-1]:
+        found = re.search(r"^charge\s+(\S+)", section, re.M)
+        if found:
+            charge = int(found.group(1))
+        job = {"gaussian": False, "atoms": atoms, "charge": charge}
+        job["omega"] = float(re.search(r"cam\s+(\S+)", section).group(1))
+        job["alpha"] = float(re.search(r"cam_alpha\s+(\S+)", section).group(1))
+        job["guess"] = re.search(r"vectors input (?!atomic)", section) is not None
+        job["orbitals"] = re.search(r"output\s+(\S+)", section).group(1)
+        cap = re.findall(r"^\s*iterations\s+(\d+)", section, re.M)
+        job["maxiter"] = int(cap[-1]) if cap else None
+        job["cores"] = CORES
+        jobs.append(job)
+    return jobs
+
+
+def read_gaussian(deck):
+    job = {"gaussian": True}
+    iops = re.search(r"3/107=(\d{5})\d{5},3/108=\d+,3/119=(\d{5})", deck)
+    job["omega"] = int(iops.group(1)) / 10000.0
+    job["alpha"] = int(iops.group(2)) / 10000.0
+    sections = re.split(r"\n\s*\n", deck)
+    charge_line = sections[2].splitlines()
+    job["charge"] = int(charge_line[0].split()[0])
+    job["atoms"] = [x.split()[0] for x in charge_line[1:]]
+    job["guess"] = "guess=read" in deck
+    job["orbitals"] = re.search(r"%chk=(\S+)", deck).group(1)
+    cap = re.search(r"maxcycle=(\d+)", deck)
+    job["maxiter"] = int(cap.group(1)) if cap else None
+    cores = re.search(r"%nprocshared=(\d+)", deck)
+    job["cores"] = int(cores.group(1)) if cores else 1
+    return job
+
+
+def fails(job):
+    # the same jobs fail whether they run alone or packed
+    point = "{0} {1} {2:.6f} {3:.6f}".format(
+        " ".join(job["atoms"]), job["charge"], job["alpha"], job["omega"]
+    )
+    draw = sha256((SEED + point).encode("utf-8")).digest()
+    return int.from_bytes(draw[:8], "big") / 2.0**64 < FAILURE
+
+
+def fortran(x, width=13, digits=6):
+    return "{0:{1}.{2}e}".format(x, width, digits).replace("e", "D")
+
+
+def iteration_line(job, i, delta):
+    if job["gaussian"]:
+        return " Cycle {0:4d}  Pass 1  IDiag  1:\n E= {1:.10f}     Delta-E= {2:.10f} Rises=F Damp=F".format(
+            i, job["energy"] + delta, -delta
+        )
+    return " d= 0,ls=0.0,diis {0:5d} {1:17.10f} {2}  1.00D-05  1.00D-06 {3:7.1f}".format(
+        i, job["energy"] + delta, fortran(-delta, 10, 2), i * LATENCY
+    )
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            jobs = read_nwchem(f.read())
+    else:
+        jobs = [read_gaussian(x) for x in sys.stdin.read().split("--Link1--\n")]
+
+    time.sleep(STARTUP)
+    for job in jobs:
+        if run(job) != 0:
+            return 1
+    return 0
+
+
+def run(job):
+    if job["gaussian"]:
+        print(" Entering Link 1 = mock_qm.py PID=     0.")
+    else:
+        print("                                 NWChem DFT Module")
+    atoms = len(job["atoms"])
+    n = sum(atomic_number(x) for x in job["atoms"]) - job["charge"]
+    job["energy"] = energy(n, atoms)
+    stalled = fails(job)
+    iterations = WARM_ITERATIONS if job["guess"] else COLD_ITERATIONS
+    if stalled:
+        iterations = STALLED_ITERATIONS
+    if job["maxiter"] is not None and job["maxiter"] < iterations:
+        stalled = True
+        iterations = job["maxiter"]
+    latency = LATENCY * ((1.0 - PARALLEL) + PARALLEL / job["cores"])
+
+    for i in range(1, iterations + 1):
+        time.sleep(latency)
+        # converging runs gain an order of magnitude every other iteration
+        delta = 1.0 if stalled else 10.0 ** (-i / 2.0)
+        print(iteration_line(job, i, delta))
+        for j in range(VERBOSE):
+            print("          Grid integrated density: {0:20.14f}".format(n + j * 1e-12))
+        sys.stdout.flush()
+
+    if stalled:
+        if job["gaussian"]:
+            print(" >>>>>>>>>> Convergence failure -- run terminated.")
+        else:
+            print(" Calculation failed to converge")
+        return 1
+
+    with open(job["orbitals"], "w") as f:
+        f.write("mock orbitals\n")
+
+    e_homo = homo(n, atoms, job["alpha"], job["omega"])
+    e_lumo = e_homo + 0.3
+    if job["gaussian"]:
+        print(
+            " SCF Done:  E(RLC-wPBE) = {0:.10f}     A.U. after {1:4d} cycles".format(
+                job["energy"], iterations
+            )
+        )
+        print(" Alpha  occ. eigenvalues -- {0:10.5f}{1:10.5f}".format(e_homo - 0.1, e_homo))
+        print(" Alpha virt. eigenvalues -- {0:10.5f}{1:10.5f}".format(e_lumo, e_lumo + 0.1))
+    else:
+        print("         Total DFT energy = {0:20.12f}".format(job["energy"]))
+        print("                       DFT Final Molecular Orbital Analysis")
+        print(" Vector    4  Occ=2.000000D+00  E={0}".format(fortran(e_homo - 0.1)))
+        print(" Vector    5  Occ=2.000000D+00  E={0}".format(fortran(e_homo)))
+        print(" Vector    6  Occ=0.000000D+00  E={0}".format(fortran(e_lumo)))
+    if job["gaussian"]:
+        print(" Normal termination of Gaussian 09")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
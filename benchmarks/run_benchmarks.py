@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+""" run_benchmarks.py -- Cost of 1D and 2D tuning runs against mock_qm.py
+Usage:
+    run_benchmarks.py [options]
+
+Options:
+    -h, --help                  Print this screen and exit
+    -n, --workers <n>           Number of QM jobs to run concurrently [default: 4]
+    -l, --latency <s>           Mock seconds per SCF iteration [default: 0.0]
+    --startup <s>               Mock seconds of program startup [default: 0.0]
+    -f, --failure <rate>        Fraction of mock jobs whose SCF stalls, a
+                                    case stops at its first failed job and
+                                    reports what it ran until then
+                                    [default: 0.0]
+    --seed <seed>               Seed of the mock failure draw [default: 0]
+    -a, --atoms <n>             Atoms in the synthetic large geometry
+                                    [default: 1000]
+    -c, --cases <names>         Comma separated cases to run [default: all]
+    -j, --json <file>           Also write the results as JSON
+"""
+from glob import glob
+from os import environ, remove
+from os.path import abspath, dirname, exists, join
+import json
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from docopt import docopt
+
+HERE = dirname(abspath(__file__))
+sys.path.insert(0, dirname(HERE))
+from Tune import Tune  # noqa: E402
+from analysis import estimate  # noqa: E402
+from executor import JobExecutor  # noqa: E402
+from mock_qm import STALLED_ITERATIONS  # noqa: E402
+from qm_output import NWCHEM_ITERATION, ConvergenceMonitor, read_output  # noqa: E402
+from qm_runner import QMRunner  # noqa: E402
+from tracer import TRACER  # noqa: E402
+from tune_parser import compiled_path  # noqa: E402
+from tuning import tune_molecule  # noqa: E402
+
+MOCK = join(HERE, "mock_qm.py")
+H2O = join(dirname(HERE), "h2o.tune-nw")
+
+# name -> (geometry, dimension, sequence of steps, SCF jobs per deck)
+CASES = {
+    "h2o-1d-grid": ("h2o", "1", ["base", "coarse", "fine"], 1),
+    "h2o-1d-grid-packed": ("h2o", "1", ["base", "coarse", "fine"], 3),
+    "h2o-1d-optimize": ("h2o", "1", ["optimize"], 1),
+    "h2o-1d-optimize-packed": ("h2o", "1", ["optimize"], 3),
+    "h2o-1d-auto": ("h2o", "1", ["auto"], 1),
+    "h2o-2d-grid": ("h2o", "2", ["base", "coarse"], 1),
+    "h2o-2d-grid-packed": ("h2o", "2", ["base", "coarse"], 3),
+    "h2o-2d-optimize": ("h2o", "2", ["optimize"], 1),
+    "h2o-2d-auto": ("h2o", "2", ["auto"], 1),
+    "large-1d-grid": ("large", "1", ["base", "coarse", "fine"], 1),
+    "large-1d-optimize": ("large", "1", ["optimize"], 1),
+    "large-1d-auto": ("large", "1", ["auto"], 1),
+    "large-2d-optimize": ("large", "2", ["optimize"], 1),
+}
+
+
+def h2o_geometry():
+    with open(H2O, "r") as f:
+        text = f.read()
+    start = text.index("geometry{")
+    return text[start : text.index("}", start) + 1]
+
+
+def large_geometry(atoms):
+    """
+    A planar polyene-like strip of carbons and hydrogens, even electron count
+    """
+    lines = ["geometry{", "    option noautoz nocenter units angstrom"]
+    for i in range(atoms - atoms % 2):
+        symbol = "c" if i % 2 == 0 else "h"
+        x = 1.4 * (i // 2)
+        y = 0.0 if symbol == "c" else 1.09 * (-1) ** (i // 2)
+        lines.append("    {0} {1:12.6f} {2:12.6f} {3:12.6f}".format(symbol, x, y, 0.0))
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def write_input(directory, name, geometry, dimension, step):
+    tune = ["tune{", "    dimension " + dimension, "    step " + step]
+    if dimension == "1":
+        tune.append("    alpha 0.2")
+    tune.append("}")
+    text = [geometry, "basis{\n    option global\n    type 6-31g*\n}", "charge 0"]
+    text.append("dft{\n    iterations 100\n}")
+    text.append("\n".join(tune))
+    path = join(directory, name + ".tune-nw")
+    with open(path, "w") as f:
+        f.write("\n\n".join(text) + "\n")
+    return path
+
+
+def stall_kills(outputs, stall):
+    """
+    SCFs the runner killed for stalling, and the iterations that spared:
+    left alone, a stalled mock job runs STALLED_ITERATIONS before it gives
+    up. Only the last task of a packed deck can have been killed, jobs
+    cancelled after the failure of another are killed while converging.
+    """
+    kills = saved = 0
+    for output in outputs:
+        with open(output, "r") as f:
+            task = f.read().split("NWChem DFT Module")[-1]
+        if "Total DFT energy" in task or "failed to converge" in task:
+            continue
+        monitor = ConvergenceMonitor(".tune-nw", stall)
+        if any(monitor.update(x) for x in task.splitlines()):
+            kills += 1
+            saved += STALLED_ITERATIONS - len(NWCHEM_ITERATION.findall(task))
+    return kills, saved
+
+
+def run_case(name, directory, geometries, workers, latency):
+    geometry, dimension, steps, pack = CASES[name]
+    path = write_input(directory, name, geometries[geometry], dimension, steps[0])
+
+    # time a cold parse, not the compiled input
+    if exists(compiled_path(path)):
+        remove(compiled_path(path))
+    start = time.perf_counter()
+    tune = Tune(path)
+    input_parse = time.perf_counter() - start
+
+    TRACER.take()
+    tracemalloc.start()
+    start = time.perf_counter()
+    points = []
+    residuals = {}
+    error = None
+    runner = QMRunner(tune, executable=MOCK)
+    try:
+        with JobExecutor(runner, workers, pack=pack) as executor:
+            for step in steps:
+                if points:
+                    alpha, omega, _ = min(points, key=lambda x: x[2])
+                    tune.tune["omega"] = str(omega)
+                    if dimension == "2":
+                        tune.tune["alpha"] = str(alpha)
+                tune.tune["step"] = step
+                points += tune_molecule(tune, executor, residuals=residuals)
+    except Exception as e:
+        # a failed SCF stops the tuning, report what ran up to it
+        error = str(e)
+    wall = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    jobs = sum(x.fields["jobs"] for x in TRACER.take() if x.name == "job")
+
+    outputs = glob(join(runner.workdir, "*.out"))
+    start = time.perf_counter()
+    for output in outputs:
+        read_output(output, tune.program)
+    output_parse = (time.perf_counter() - start) / max(len(outputs), 1)
+    kills, saved = stall_kills(outputs, runner.stall)
+
+    result = {
+        "case": name,
+        "atoms": len(tune.geometry["symbols"]),
+        # refinement grids share points with the previous step
+        "points": len(residuals),
+        "jobs": jobs,
+        "wall": wall,
+        "jobs_per_s": jobs / wall,
+        "peak_heap_mb": peak / 1e6,
+        "input_parse": input_parse,
+        "output_parse": output_parse,
+        "kills": kills,
+        "saved_s": saved * latency,
+    }
+    if error is not None:
+        result["error"] = error
+        return result
+    alpha, omega, j = min(points, key=lambda x: x[2])
+    found = estimate(tune, residuals)
+    result.update(
+        {
+            "alpha": alpha,
+            "omega": omega,
+            "J": j,
+            "fit_omega": found.omega if found else float("nan"),
+            "fit_J": found.j if found else float("nan"),
+        }
+    )
+    return result
+
+def main():
+    arguments = docopt(__doc__)
+    environ["MOCK_QM_LATENCY"] = arguments["--latency"]
+    environ["MOCK_QM_STARTUP"] = arguments["--startup"]
+    environ["MOCK_QM_FAILURE"] = arguments["--failure"]
+    environ["MOCK_QM_SEED"] = arguments["--seed"]
+    workers = int(arguments["--workers"])
+    names = list(CASES)
+    if arguments["--cases"] != "all":
+        names = arguments["--cases"].split(",")
+    geometries = {
+        "h2o": h2o_geometry(),
+        "large": large_geometry(int(arguments["--atoms"])),
+    }
+
+    header = "{0:<24} {1:>6} {2:>6} {3:>6} {4:>9} {5:>7} {6:>9} {7:>10} {8:>10} {9:>6} {10:>8} {11:>7} {12:>7} {13:>10} {14:>7} {15:>10}"
+    row = "{0:<24} {1:6d} {2:6d} {3:6d} {4:9.2f} {5:7.1f} {6:9.2f} {7:10.4f} {8:10.5f} {9:6d} {10:8.2f}"
+    tuned = " {0:7.4f} {1:7.4f} {2:10.2e} {3:7.4f} {4:10.2e}"
+    print(
+        header.format(
+            "case", "atoms", "points", "jobs", "wall s", "jobs/s", "heap MB",
+            "input s", "output s", "kills", "saved s", "alpha", "omega", "J",
+            "fit w", "fit J",
+        )
+    )  # fmt: skip
+    results = []
+    directory = tempfile.mkdtemp(prefix="tune-it-bench-")
+    try:
+        for name in names:
+            try:
+                result = run_case(
+                    name, directory, geometries, workers, float(arguments["--latency"])
+                )
+            except Exception as e:
+                print("{0:<24} failed: {1}".format(name, e))
+                results.append({"case": name, "error": str(e), "failed": True})
+                continue
+            results.append(result)
+            line = row.format(*[result[x] for x in [
+                "case", "atoms", "points", "jobs", "wall", "jobs_per_s", "peak_heap_mb",
+                "input_parse", "output_parse", "kills", "saved_s",
+            ]])  # fmt: skip
+            if "error" in result:
+                line += "  stopped: " + result["error"]
+            else:
+                line += tuned.format(*[result[x] for x in [
+                    "alpha", "omega", "J", "fit_omega", "fit_J",
+                ]])  # fmt: skip
+            print(line)
+    finally:
+        shutil.rmtree(directory)
+
+    # the workers and mock QM processes are children of this process
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print("Peak RSS of any child process: {0:.1f} MB".format(children / 1024.0))
+    if arguments["--json"]:
+        with open(arguments["--json"], "w") as f:
+            json.dump(results, f, indent=2)
+    # with a failure rate, cases are expected to stop at a failed job
+    expected = float(arguments["--failure"]) > 0.0
+    return 0 if all("failed" not in x and (expected or "error" not in x) for x in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+    Class ResultCache -- persistent, size bounded cache of extracted SCF
+    results keyed by a canonical hash of everything that defines a job
+"""
+from hashlib import sha256
+from os import makedirs
+from os.path import dirname, expanduser
+import json
+import sqlite3
+import threading
+import time
+
+from tune_parser import geometry_lines
+
+DEFAULT_PATH = "~/.cache/tune-it/results.sqlite"
+
+
+def cache_key(tune, job, executable=None):
+    """
+    sha256 of a canonical JSON document describing the job. Lines are
+    lowercased and whitespace normalized so cosmetic differences in the
+    input don't defeat the cache. executable is the path of the QM
+    program, results of different programs (or of a mock) never mix.
+    """
+
+    def canonical(lines):
+        return [" ".join(x.lower().split()) for x in lines]
+
+    document = {
+        "program": tune.program,
+        "executable": executable,
+        "geometry": canonical(geometry_lines(tune.geometry)),
+        "geometry_option": canonical(tune.geometry.get("option", [])),
+        "basis": canonical(tune.basis["basis"]),
+        "basis_option": tune.basis["option"],
+        "ecp": canonical(tune.ecp.get("ecp", [])),
+        "ecp_option": tune.ecp.get("option", []),
+        "charge": int(tune.charge),
+        "dft": canonical(tune.dft),
+        "alpha": "{0:.6f}".format(job.alpha),
+        "omega": "{0:.6f}".format(job.omega),
+        "electrons": tune.electrons(job.charge),
+    }
+    encoded = json.dumps(document, sort_keys=True, separators=(",", ":"))
+    return sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    SQLite backed key -> results store with least recently used eviction
+    once more than max_entries results are stored. Safe to share between
+    the threads of a JobExecutor.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=100000):
+        self.path = expanduser(path)
+        self.max_entries = max_entries
+        if dirname(self.path):
+            makedirs(dirname(self.path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results "
+            + "(key TEXT PRIMARY KEY, result TEXT NOT NULL, used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        self.db.commit()
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def put(self, key, result):
+        with self.lock:
+            self._put(key, result)
+
+    def _get(self, key):
+        row = self.db.execute(
+            "SELECT result FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        self.db.execute(
+            "UPDATE results SET used = ? WHERE key = ?", (time.time(), key)
+        )
+        self.db.commit()
+        return json.loads(row[0])
+
+    def _put(self, key, result):
+        self.db.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+            (key, json.dumps(result), time.time()),
+        )
+        count = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if count > self.max_entries:
+            self.db.execute(
+                "DELETE FROM results WHERE key IN "
+                + "(SELECT key FROM results ORDER BY used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+    Client -- talks to a tune-it.py daemon over its Unix socket
+
+    A request and its response are each a single line of JSON, one request
+    per connection. This module only uses the standard library, so a
+    client starts without loading any of the tuning machinery.
+"""
+from os.path import expanduser
+import json
+import socket
+
+DEFAULT_SOCKET = "~/.cache/tune-it/daemon.sock"
+
+
+def _connect(path):
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(expanduser(path))
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+
+def listening(path=DEFAULT_SOCKET):
+    """
+    Whether a daemon accepts connections on path, a socket file left by a
+    daemon that died doesn't count
+    """
+    try:
+        _connect(path).close()
+    except OSError:
+        return False
+    return True
+
+
+def request(path, message):
+    """
+    Send message (a dictionary) to the daemon on path and return its
+    response, a response with an error raises it
+    """
+    try:
+        connection = _connect(path)
+    except OSError as e:
+        raise Exception(
+            "Daemon Error: no tune-it.py daemon on {0} ({1})".format(path, e)
+        )
+    with connection, connection.makefile("rwb") as stream:
+        stream.write(json.dumps(message).encode("utf-8") + b"\n")
+        stream.flush()
+        line = stream.readline()
+    if not line:
+        raise Exception("Daemon Error: the daemon on {0} hung up".format(path))
+    response = json.loads(line)
+    if "error" in response:
+        raise Exception(response["error"])
+    return response
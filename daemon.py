@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+"""
+    Class TuneDaemon -- long running tune-it.py that takes tunings over a
+    Unix socket
+
+    The daemon keeps one JobExecutor, and with it the warm worker
+    processes, the job queue and the result cache, along with the priors
+    and the parsed inputs, for every tuning submitted to it. A submission
+    costs a socket round trip instead of a Python start, an input parse and
+    a pool spin-up, and concurrent submissions share the workers: the
+    molecule with the fewest running jobs goes first (see JobExecutor).
+
+    Requests are single lines of JSON (see client), by command:
+        submit  inputs (a list of paths) or batch (a directory or manifest),
+                exhaustive, and wait to answer only once they are tuned
+        status  every tuning the daemon knows of, and the executor's load
+        wait    ids of submitted tunings, answers once they are tuned
+        stop    stop taking requests, exit once the running tunings end
+    Every response holds either "report", lines to print, or "error".
+"""
+from collections import OrderedDict
+from copy import deepcopy
+from os import chmod, makedirs, remove, stat
+from os.path import abspath, dirname, exists, expanduser
+import json
+import socketserver
+import threading
+import time
+
+from analysis import estimate
+from batch import (
+    BatchRunner,
+    molecule_report,
+    read_input,
+    read_manifest,
+    results_table,
+)
+from client import listening
+from tracer import TRACER
+from tuning import optimum, tune_molecule
+
+# Parsed inputs and finished tunings kept
+INPUTS = 1000
+FINISHED = 1000
+
+
+class DaemonRunner(BatchRunner):
+    """
+    BatchRunner whose molecules are added and removed as tunings come and
+    go, route hands the executor the runner of a job's molecule
+    """
+
+    def __init__(self):
+        self.runners = {}
+
+    def add(self, runner):
+        self.runners[runner.tune.name] = runner
+
+    def remove(self, name):
+        self.runners.pop(name, None)
+
+    def route(self, job):
+        return self.runners[job.name]
+
+
+class _Tuning:
+    """
+    One molecule submitted to the daemon, outcome is the list of (alpha,
+    omega, J) once it is tuned or the exception that stopped it
+    """
+
+    def __init__(self, number, tune, exhaustive):
+        self.id = number
+        self.tune = tune
+        self.exhaustive = exhaustive
+        self.residuals = {}
+        self.outcome = None
+        self.report = []
+        self.submitted = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def state(self):
+        if not self.done.is_set():
+            return "running"
+        return "failed" if isinstance(self.outcome, Exception) else "done"
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # a client checking that the daemon listens
+            return
+        try:
+            response = self.server.tune_daemon.handle(json.loads(line))
+        except Exception as e:
+            response = {"error": str(e)}
+        try:
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+        except BrokenPipeError:
+            # the client gave up waiting, its tunings carry on
+            pass
+
+
+class TuneDaemon:
+    """
+    Serves tunings on the Unix socket path. The executor's runner is a
+    DaemonRunner, make_runner(tune) builds the QMRunner of a submitted
+    molecule (and may refuse it, e.g. when it doesn't fit the memory of a
+    job). priors and journal are optional, as for a tune-it.py run.
+    """
+
+    def __init__(self, path, executor, make_runner, priors=None, journal=None):
+        self.path = expanduser(path)
+        self.executor = executor
+        self.runner = executor.runner
+        self.make_runner = make_runner
+        self.priors = priors
+        self.journal = journal
+        self.lock = threading.Lock()
+        self.inputs = OrderedDict()
+        self.tunings = OrderedDict()
+        self.count = 0
+        self.server = None
+
+    def serve(self):
+        """
+        Take requests until a stop request, then wait for the running
+        tunings
+        """
+        if listening(self.path):
+            raise Exception(
+                "Daemon Error: a daemon already listens on {0}".format(self.path)
+            )
+        if dirname(self.path):
+            makedirs(dirname(self.path), exist_ok=True)
+        if exists(self.path):
+            # left behind by a daemon that died
+            remove(self.path)
+        self.server = socketserver.ThreadingUnixStreamServer(self.path, _Handler)
+        self.server.daemon_threads = True
+        self.server.tune_daemon = self
+        chmod(self.path, 0o600)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            remove(self.path)
+        for tuning in list(self.tunings.values()):
+            tuning.done.wait()
+
+    def handle(self, message):
+        command = message.get("command")
+        if command == "submit":
+            return self.submit(message)
+        if command == "status":
+            return {"report": self.status()}
+        if command == "wait":
+            return self.wait(message["ids"])
+        if command == "stop":
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            running = sum(not x.done.is_set() for x in self.tunings.values())
+            return {"report": ["Stopping: {0} tunings still running".format(running)]}
+        raise Exception("Daemon Error: unknown command {0}".format(command))
+
+    def read(self, path):
+        """
+        Parsed input at path, from memory unless the file changed since.
+        Every tuning gets a copy of its own.
+        """
+        path = abspath(path)
+        modified = stat(path).st_mtime if exists(path) else None
+        with self.lock:
+            found = self.inputs.get(path)
+        if found is None or found[0] != modified:
+            found = (modified, read_input(path))
+        with self.lock:
+            self.inputs[path] = found
+            self.inputs.move_to_end(path)
+            while len(self.inputs) > INPUTS:
+                self.inputs.popitem(last=False)
+        return deepcopy(found[1])
+
+    def submit(self, message):
+        """
+        Start tuning every input of the request, none of them if any can't
+        be read or is already being tuned
+        """
+        inputs = message.get("inputs") or []
+        if message.get("batch"):
+            inputs = read_manifest(message["batch"])
+        if not inputs:
+            raise Exception("Input Error: no tuning inputs to submit")
+        tunes = [self.read(x) for x in inputs]
+        runners = [self.make_runner(x) for x in tunes]
+        exhaustive = bool(message.get("exhaustive"))
+
+        tunings = []
+        with self.lock:
+            names = [x.tune.name for x in self.tunings.values() if not x.done.is_set()]
+            for tune in tunes:
+                if tune.name in names:
+                    raise Exception(
+                        "Daemon Error: {0} is already being tuned".format(tune.name)
+                    )
+                names.append(tune.name)
+            for tune, runner in zip(tunes, runners):
+                self.count += 1
+                tuning = _Tuning(self.count, tune, exhaustive)
+                self.tunings[tuning.id] = tuning
+                self.runner.add(runner)
+                tunings.append(tuning)
+            self._trim()
+        for tuning in tunings:
+            threading.Thread(target=self.run, args=(tuning,), daemon=True).start()
+
+        ids = [x.id for x in tunings]
+        if message.get("wait"):
+            return self.wait(ids)
+        return {
+            "ids": ids,
+            "report": ["Submitted: {0} {1}".format(x.id, x.tune.name) for x in tunings],
+        }
+
+    def run(self, tuning):
+        tune = tuning.tune
+        try:
+            prior = None
+            if self.priors is not None and not tuning.exhaustive:
+                prior = self.priors.predict(tune)
+            points = tune_molecule(
+                tune, self.executor, tuning.exhaustive, tuning.residuals, prior
+            )
+            found = estimate(tune, tuning.residuals)
+            if self.priors is not None:
+                self.priors.record(tune, *optimum(tune, tuning.residuals, found))
+            tuning.report = molecule_report(
+                tune, points, tuning.residuals, found, prior
+            )
+            tuning.outcome = points
+        except Exception as e:
+            tuning.outcome = e
+        finally:
+            # cancelled packs still need its runner to be terminated
+            self.executor.drain(tune.name)
+            self.runner.remove(tune.name)
+            self.executor.forget(tune.name)
+            if self.journal is not None:
+                self.journal.release(tune.name)
+            # nobody writes out the spans of a daemon
+            TRACER.take()
+            tuning.finished = time.time()
+            tuning.done.set()
+
+    def wait(self, ids):
+        """
+        Report on the tunings ids once they are all over, a single tuning
+        that failed answers with its error
+        """
+        with self.lock:
+            missing = [x for x in ids if x not in self.tunings]
+            tunings = [self.tunings[x] for x in ids if x in self.tunings]
+        if missing:
+            raise Exception(
+                "Daemon Error: no tunings {0}".format(", ".join(map(str, missing)))
+            )
+        for tuning in tunings:
+            tuning.done.wait()
+        if len(tunings) == 1:
+            if isinstance(tunings[0].outcome, Exception):
+                return {"ids": ids, "error": str(tunings[0].outcome)}
+            return {"ids": ids, "report": tunings[0].report}
+        outcomes = {x.tune.name: x.outcome for x in tunings}
+        return {
+            "ids": ids,
+            "report": results_table([x.tune for x in tunings], outcomes),
+        }
+
+    def status(self):
+        running, queued = self.executor.load()
+        lines = [
+            "Daemon: {0} workers, {1} packs running, {2} queued, {3} parsed inputs".format(
+                self.executor.workers, running, queued, len(self.inputs)
+            ),
+            "{0:>6} {1:<8} {2:>6} {3:>9}  {4}".format(
+                "id", "state", "points", "elapsed", "molecule"
+            ),
+        ]
+        now = time.time()
+        with self.lock:
+            tunings = list(self.tunings.values())
+        for x in tunings:
+            lines.append(
+                "{0:6d} {1:<8} {2:6d} {3:9.1f}  {4}".format(
+                    x.id,
+                    x.state(),
+                    len(x.residuals),
+                    (x.finished or now) - x.submitted,
+                    x.tune.name,
+                )
+            )
+        return lines
+
+    def _trim(self):
+        # forget the oldest finished tunings, called with the lock held
+        finished = [x for x in self.tunings.values() if x.done.is_set()]
+        for tuning in finished[: max(len(finished) - FINISHED, 0)]:
+            del self.tunings[tuning.id]
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+    Elements -- atomic numbers for counting electrons from a geometry block
+"""
+import re
+
+SYMBOLS = [
+    "h", "he",
+    "li", "be", "b", "c", "n", "o", "f", "ne",
+    "na", "mg", "al", "si", "p", "s", "cl", "ar",
+    "k", "ca", "sc", "ti", "v", "cr", "mn", "fe", "co", "ni", "cu", "zn",
+    "ga", "ge", "as", "se", "br", "kr",
+    "rb", "sr", "y", "zr", "nb", "mo", "tc", "ru", "rh", "pd", "ag", "cd",
+    "in", "sn", "sb", "te", "i", "xe",
+    "cs", "ba", "la", "ce", "pr", "nd", "pm", "sm", "eu", "gd", "tb", "dy",
+    "ho", "er", "tm", "yb", "lu", "hf", "ta", "w", "re", "os", "ir", "pt",
+    "au", "hg", "tl", "pb", "bi", "po", "at", "rn",
+]  # fmt: skip
+ATOMIC_NUMBERS = {x: i + 1 for i, x in enumerate(SYMBOLS)}
+
+
+def element(tag):
+    """
+    Element symbol of a geometry tag, NWChem allows tags like H1 or O_water
+    """
+    symbol = re.match(r"[a-z]*", tag.lower()).group(0)
+    if symbol in ATOMIC_NUMBERS:
+        return symbol
+    # tags such as 'ha' for a labelled hydrogen, fall back on the first letter
+    if symbol[:1] in ATOMIC_NUMBERS:
+        return symbol[:1]
+    raise Exception("Geometry Error: unknown element in tag {0}".format(tag))
+
+
+def atomic_number(tag):
+    return ATOMIC_NUMBERS[element(tag)]
@@ -0,0 +1,450 @@
+#!/usr/bin/env python
+"""
+    Class JobExecutor -- runs independent QM jobs concurrently on a pool of
+    worker processes
+"""
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from os import cpu_count
+import signal
+import threading
+import time
+
+from tracer import TRACER
+from work_queue import QueuePool
+
+# Each worker process receives the runner once, when it starts, instead of
+#  having it pickled along with every job
+_runner = None
+
+
+def _set_runner(runner):
+    global _runner
+    _runner = runner
+
+
+def _initialize_worker(runner):
+    _set_runner(runner)
+    # Ctrl-C reaches the whole process group, only the parent handles it
+    #  (a worker interrupted inside the pool's queue deadlocks the others)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _terminate_job(jobs, guesses, runner=None):
+    """
+    Stop a cancelled pack running on a work queue worker
+    """
+    terminate = getattr(runner or _runner, "terminate", None)
+    if terminate is not None:
+        terminate(jobs[0])
+
+
+def _run_job(jobs, guesses, runner=None):
+    """
+    Run a pack of jobs in a worker, a list with the results (or exception)
+    of each job comes back along with the spans, those of failed jobs
+    too. runner replaces the worker's own for this pack when given.
+    """
+    TRACER.take()
+    runner = runner or _runner
+    job = jobs[0]
+    with TRACER.span(
+        "job",
+        molecule=job.name,
+        charge=job.charge,
+        alpha=job.alpha,
+        omega=job.omega,
+        jobs=len(jobs),
+    ):
+        if len(jobs) == 1:
+            try:
+                results = [runner(job, guesses[0])]
+            except Exception as e:
+                results = [e]
+        else:
+            results = runner.pack(jobs, guesses)
+    return results, TRACER.take()
+
+
+class _Run:
+    """
+    Bookkeeping for one call to JobExecutor.run
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.keys = {}
+        self.remaining = 0
+        self.error = None
+        self.cancelled = False
+        self.interrupted = False
+
+    def done(self):
+        return self.remaining == 0 or self.error is not None
+
+
+class JobExecutor:
+    """
+    The runner is any picklable callable taking a Job and an optional
+    finished Job to start its SCF from, and returning the job's results,
+    e.g. a QMRunner or a fake for testing. With a ResultCache the runner
+    must also provide key(job), and cached jobs never reach the pool.
+    Likewise with a Journal, every job is recorded as it is submitted and
+    finishes, and jobs the journal has completed results for are skipped.
+
+    With warm_start, jobs of the same molecule and charge are sorted by
+    (alpha, omega) and split into chains; a chain runs one job after the
+    other so each can start from its nearest finished neighbour. There are
+    enough chains to keep every worker busy.
+
+    With pack > 1 the jobs of a molecule are sorted by (alpha, omega,
+    charge) and cut into packs of up to pack jobs, every pack runs as a
+    single QM program invocation through runner.pack(jobs, guesses). The
+    charge states of a point and neighbouring points share a deck, and
+    chains are made of packs instead of jobs.
+
+    run may be called from several threads at once (one per molecule in a
+    batch). Jobs wait in a queue per molecule and are handed to the pool
+    only when a worker is free: the molecule with the fewest running jobs
+    goes first and ties go to the most expensive molecule, according to
+    runner.cost(job) when the runner has one.
+
+    Jobs are handed to the pool by a dispatcher thread and the completion
+    callbacks, never by the calling thread, so a Ctrl-C in the main thread
+    can't land inside the pool's internals and hang its shutdown.
+
+    With a work_queue path the jobs are published to that work queue for
+    tune-it.py worker processes, on this or other nodes, instead of a local
+    process pool; workers is then the number of jobs published at once.
+
+    When the runner provides route(job), the runner it returns for the
+    job's molecule is sent along with every pack: the workers only get
+    the runner once, and a daemon's molecules come and go after that.
+
+    start, wait, result and cancel split run up for callers that evaluate
+    speculatively. Cancelling a run drops its queued jobs and, when the
+    runner provides terminate(job) and clean(job), kills its running jobs
+    and removes the files they leave behind.
+    """
+
+    def __init__(
+        self,
+        runner,
+        workers=None,
+        cache=None,
+        warm_start=True,
+        journal=None,
+        pack=1,
+        work_queue=None,
+    ):
+        self.runner = runner
+        self.cache = cache
+        self.journal = journal
+        self.warm_start = warm_start
+        self.pack = pack
+        self.workers = workers or cpu_count() or 1
+        if work_queue is not None:
+            self.pool = QueuePool(work_queue, _set_runner, (runner,), _terminate_job)
+        else:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_initialize_worker,
+                initargs=(runner,),
+            )
+        # (name, charge) -> jobs finished by this executor, candidate guesses
+        self.finished = {}
+        # name -> [(pack, rest of its chain, _Run, queued at)] waiting for a
+        #  worker, and future -> the same tuple for submitted packs, a pack
+        #  is a list of jobs run by one QM program invocation
+        self.queue = {}
+        self.running = {}
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dispatcher = threading.Thread(target=self._dispatcher, daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, jobs, guesses):
+        route = getattr(self.runner, "route", None)
+        if route is not None:
+            return self.pool.submit(_run_job, jobs, guesses, route(jobs[0]))
+        return self.pool.submit(_run_job, jobs, guesses)
+
+    def forget(self, name):
+        """
+        Drop the finished jobs of molecule name kept for warm starts, for
+        callers that outlive many molecules
+        """
+        with self.condition:
+            for key in [x for x in self.finished if x[0] == name]:
+                del self.finished[key]
+
+    def drain(self, name):
+        """
+        Block until no pack of molecule name is queued or running, e.g.
+        the cancelled packs of a run that gave up and are still being
+        terminated, before dropping the molecule's runner
+        """
+        with self.condition:
+            while self.queue.get(name) or any(
+                x[0][0].name == name for x in self.running.values()
+            ):
+                self.condition.wait()
+
+    def load(self):
+        """
+        Number of running and of queued packs
+        """
+        with self.condition:
+            return len(self.running), sum(len(x) for x in self.queue.values())
+
+    def run(self, jobs):
+        """
+        Run every job and return a dictionary of job -> results, the first
+        failed job raises its exception after the others are cancelled
+        """
+        state = self.start(jobs)
+        interrupted = False
+        try:
+            self.wait([state])
+        except KeyboardInterrupt:
+            interrupted = True
+            raise
+        finally:
+            if state.remaining:
+                self.cancel(state, interrupted)
+        return self.result(state)
+
+    def start(self, jobs):
+        """
+        Queue jobs without waiting for them, returns a handle for wait,
+        result and cancel
+        """
+        state = _Run()
+        pending = []
+        for job in dict.fromkeys(jobs):
+            result = None
+            if self.cache is not None or self.journal is not None:
+                state.keys[job] = self.runner.key(job)
+            if self.journal is not None:
+                result = self.journal.result(job, state.keys[job])
+            if result is None and self.cache is not None:
+                with TRACER.span("cache", molecule=job.name) as fields:
+                    result = self.cache.get(state.keys[job])
+                    fields["hit"] = result is not None
+                if result is not None and self.journal is not None:
+                    self.journal.record("completed", job, state.keys[job], result)
+            if result is not None:
+                state.results[job] = result
+                # its orbitals may still be around from an earlier run
+                with self.condition:
+                    self._finish(job)
+                continue
+            pending.append(job)
+
+        with self.condition:
+            state.remaining = len(pending)
+            for chain in self._chains(pending):
+                self.queue.setdefault(chain[0][0].name, []).append(
+                    (chain[0], chain[1:], state, time.time())
+                )
+            self.condition.notify_all()
+        return state
+
+    def wait(self, states):
+        """
+        Block until at least one of the started runs is done, returns the
+        ones that are
+        """
+        with self.condition:
+            while not any(x.done() for x in states):
+                self.condition.wait()
+            return [x for x in states if x.done()]
+
+    def result(self, state):
+        """
+        Dictionary of job -> results of a finished run, or the exception of
+        its first failed job
+        """
+        if state.error is not None:
+            raise state.error
+        return state.results
+
+    def cancel(self, state, interrupted=False):
+        """
+        Give up on a run: its queued jobs are dropped, submitted ones are
+        cancelled or terminated. The journal records those as cancelled,
+        or as failed when the run was interrupted: a later run has to
+        resume them.
+        """
+        with self.condition:
+            state.cancelled = True
+            state.interrupted = state.interrupted or interrupted
+            for name in self.queue:
+                self.queue[name] = [x for x in self.queue[name] if x[2] is not state]
+            terminate = getattr(self.runner, "terminate", None)
+            for future, (jobs, _, owner, _) in list(self.running.items()):
+                if owner is state and not future.cancel() and terminate is not None:
+                    terminate(jobs[0])
+
+    def _dispatcher(self):
+        with self.condition:
+            while not self.closed:
+                self._dispatch()
+                self.condition.wait()
+
+    def _dispatch(self):
+        """
+        Hand queued jobs to the pool while there are free workers, called
+        with the condition held
+        """
+        while not self.closed and len(self.running) < self.workers:
+            names = [x for x in self.queue if self.queue[x]]
+            if not names:
+                return
+            load = {}
+            for jobs, _, _, _ in self.running.values():
+                load[jobs[0].name] = load.get(jobs[0].name, 0) + 1
+            name = min(names, key=lambda x: (load.get(x, 0), -self._cost(x)))
+            jobs, chain, state, queued = self.queue[name].pop(0)
+            submitted = time.time()
+            TRACER.add("queue", queued, submitted, molecule=name)
+            if self.journal is not None:
+                for job in jobs:
+                    self.journal.record("submitted", job, state.keys[job])
+            future = self.submit(jobs, [self._guess(x) for x in jobs])
+            self.running[future] = (jobs, chain, state, submitted)
+            future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self.condition:
+            try:
+                jobs, chain, state, submitted = self.running.pop(future)
+                if future.cancelled():
+                    # the run that owned it has already given up
+                    if self.journal is not None:
+                        event = self._stopped(state)
+                        for job in jobs:
+                            self.journal.record(event, job, state.keys[job])
+                    results = []
+                elif future.exception() is not None:
+                    results = [future.exception()] * len(jobs)
+                else:
+                    results, spans = future.result()
+                    # time between submission and the worker picking the job up
+                    TRACER.extend(spans)
+                    started = min([x[1] for x in spans if x[0] == "job"] or [submitted])
+                    TRACER.add("dispatch", submitted, started, molecule=jobs[0].name)
+                for job, result in zip(jobs, results):
+                    if isinstance(result, Exception):
+                        self._failed(job, state, result)
+                    else:
+                        self._completed(job, state, result)
+                if results and chain and state.error is None and not state.cancelled:
+                    self.queue.setdefault(jobs[0].name, []).insert(
+                        0, (chain[0], chain[1:], state, time.time())
+                    )
+            finally:
+                # whatever went wrong above, the other molecules carry on
+                self.condition.notify_all()
+                self._dispatch()
+
+    def _completed(self, job, state, result):
+        state.results[job] = result
+        state.remaining -= 1
+        if self.journal is not None:
+            self.journal.record("completed", job, state.keys[job], result)
+        if self.cache is not None:
+            self.cache.put(state.keys[job], result)
+        self._finish(job)
+
+    def _failed(self, job, state, error):
+        if self.journal is not None:
+            event = self._stopped(state) if state.cancelled else "failed"
+            self.journal.record(event, job, state.keys[job], error=str(error))
+        if state.cancelled:
+            # most likely terminated, don't leave its scratch behind
+            clean = getattr(self.runner, "clean", None)
+            if clean is not None:
+                clean(job)
+        else:
+            state.error = state.error or error
+
+    def _stopped(self, state):
+        # jobs still running when the executor shuts down were interrupted
+        #  too, only jobs a run gave up on count as done with
+        if state.interrupted or self.closed:
+            return "failed"
+        return "cancelled"
+
+    def _cost(self, name):
+        cost = getattr(self.runner, "cost", None)
+        if cost is None or not self.queue.get(name):
+            return 0
+        return cost(self.queue[name][0][0][0])
+
+    def _finish(self, job):
+        self.finished.setdefault((job.name, job.charge), []).append(job)
+
+    def _chains(self, jobs):
+        """
+        Split jobs into chains of packs that run sequentially, one pack per
+        chain without warm start
+        """
+        packs = self._packs(jobs)
+        if not self.warm_start:
+            return [[x] for x in packs]
+        groups = {}
+        for pack in packs:
+            # packs hold every charge state of their points
+            key = (pack[0].name, pack[0].charge if self.pack <= 1 else None)
+            groups.setdefault(key, []).append(pack)
+        count = max(1, ceil(self.workers / max(1, len(groups))))
+        chains = []
+        for group in groups.values():
+            group.sort(key=lambda x: (x[0].alpha, x[0].omega))
+            size = ceil(len(group) / count)
+            chains += [group[i : i + size] for i in range(0, len(group), size)]
+        return chains
+
+    def _packs(self, jobs):
+        """
+        Cut the jobs of each molecule, sorted by (alpha, omega, charge),
+        into packs of at most self.pack jobs, as evenly as possible
+        """
+        if self.pack <= 1:
+            return [[x] for x in jobs]
+        groups = {}
+        for job in jobs:
+            groups.setdefault(job.name, []).append(job)
+        packs = []
+        for group in groups.values():
+            group.sort(key=lambda x: (x.alpha, x.omega, x.charge))
+            size = ceil(len(group) / ceil(len(group) / self.pack))
+            packs += [group[i : i + size] for i in range(0, len(group), size)]
+        return packs
+
+    def _guess(self, job):
+        """
+        Nearest finished job of the same molecule and charge, if any
+        """
+        if not self.warm_start:
+            return None
+        candidates = self.finished.get((job.name, job.charge))
+        if not candidates:
+            return None
+        return min(
+            candidates,
+            key=lambda x: abs(x.alpha - job.alpha) + abs(x.omega - job.omega),
+        )
+
+    def shutdown(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
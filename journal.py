@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+    Class Journal -- append-only, crash safe record of the SCF jobs of a
+    tuning campaign
+
+    Every molecule gets its own journal next to its input, Tune.name +
+    ".journal", with one JSON object per line for each job submitted,
+    completed, failed or cancelled. Lines are fsync'd as they are written,
+    so a run killed by a walltime limit or a node failure loses at most
+    the line being written. On --resume the completed jobs are replayed as
+    a memo: running the tuning steps again takes the J values of every
+    point evaluated before from the journal, and only points it doesn't
+    have reach the pool. Which points a speculative scan evaluates depends
+    on the timing of its jobs, so a resumed run may still evaluate a few
+    points the interrupted one never got to, or skip some it did.
+
+    A run without --resume starts the journals over, unless one of them
+    holds jobs that were submitted and never completed nor cancelled:
+    those are from a run that was interrupted (or stopped by a failed
+    job), which only --resume continues.
+"""
+from os import fsync
+import json
+import threading
+import time
+
+EVENTS = ["submitted", "completed", "failed", "cancelled"]
+
+
+def journal_path(name):
+    """
+    Journal of a molecule, h2o.tune-nw -> h2o.journal
+    """
+    return name + ".journal"
+
+
+def _records(path):
+    """
+    Records of a journal, a torn last line from a crash is ignored
+    """
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        return
+
+
+def _unfinished(path):
+    """
+    (alpha, omega, charge) -> last record of every job of a journal last
+    seen submitted or failed
+    """
+    last = {}
+    for record in _records(path):
+        last[tuple(record["job"])] = record
+    return {x: y for x, y in last.items() if y["event"] in ["submitted", "failed"]}
+
+
+def _ends_line(path):
+    with open(path, "rb") as f:
+        f.seek(-1, 2)
+        return f.read(1) == b"\n"
+
+
+def _line(event, point, key=None, result=None, error=None):
+    if event not in EVENTS:
+        raise Exception("Journal Error: unknown event {0}".format(event))
+    record = {"event": event, "time": time.time(), "job": point}
+    if key is not None:
+        record["key"] = key
+    if result is not None:
+        record["result"] = result
+    if error is not None:
+        record["error"] = error
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+
+def _point(job):
+    # the journal is per molecule, and names move with the working directory
+    return [job.alpha, job.omega, job.charge]
+
+
+class Journal:
+    """
+    Journals of every molecule of a run, keyed by Job.name (Tune.name).
+    Without resume existing journals are started over (an unfinished one
+    raises instead), with resume their completed jobs are loaded and
+    handed back by result. Safe to share between the threads of a
+    JobExecutor.
+    """
+
+    def __init__(self, resume=False):
+        self.resume = resume
+        self.lock = threading.Lock()
+        self.files = {}
+        # name -> {(alpha, omega, charge): (key, results)}
+        self.completed = {}
+
+    def _open(self, name):
+        if name not in self.files:
+            path = journal_path(name)
+            unfinished = 0 if self.resume else self.unfinished(path)
+            if unfinished:
+                raise Exception(
+                    (
+                        "Journal Error: {0} holds {1} jobs that never "
+                        + "completed, continue their run with --resume or "
+                        + "remove the journal"
+                    ).format(path, unfinished)
+                )
+            self.completed[name] = self.replay(path) if self.resume else {}
+            self.files[name] = open(path, "a" if self.resume else "w")
+            if self.files[name].tell() > 0 and not _ends_line(path):
+                # end a torn line so the next record starts on its own
+                self.files[name].write("\n")
+        return self.files[name]
+
+    @staticmethod
+    def replay(path):
+        """
+        Completed jobs of a journal
+        """
+        completed = {}
+        for record in _records(path):
+            if record["event"] == "completed":
+                completed[tuple(record["job"])] = (
+                    record.get("key"),
+                    record["result"],
+                )
+        return completed
+
+    @staticmethod
+    def unfinished(path):
+        """
+        Number of jobs of a journal last seen submitted or failed, i.e.
+        running when the run was interrupted, or killed by it
+        """
+        return len(_unfinished(path))
+
+    def result(self, job, key=None):
+        """
+        Results of job from the journal, None unless it completed with the
+        same cache key (the input may have changed since)
+        """
+        with self.lock:
+            self._open(job.name)
+            found = self.completed[job.name].get(tuple(_point(job)))
+        if found is None or found[0] != key:
+            return None
+        return found[1]
+
+    def record(self, event, job, key=None, result=None, error=None):
+        line = _line(event, _point(job), key, result, error)
+        with self.lock:
+            f = self._open(job.name)
+            f.write(line)
+            f.flush()
+            fsync(f.fileno())
+
+    def settle(self, name):
+        """
+        Record the jobs of molecule name that an earlier, interrupted run
+        left unfinished as cancelled, once this run has tuned it: a resumed
+        scan need not go back to every point that was running
+        """
+        with self.lock:
+            f = self.files.get(name)
+            if f is None:
+                return
+            f.flush()
+            for point, record in _unfinished(journal_path(name)).items():
+                f.write(_line("cancelled", list(point), record.get("key")))
+            f.flush()
+            fsync(f.fileno())
+
+    def release(self, name):
+        """
+        Close the journal of molecule name and forget its completed jobs,
+        the next job of that name opens it again
+        """
+        with self.lock:
+            f = self.files.pop(name, None)
+            if f is not None:
+                f.close()
+            self.completed.pop(name, None)
+
+    def replayed(self):
+        """
+        Number of completed jobs loaded from the journals so far
+        """
+        with self.lock:
+            return sum(len(x) for x in self.completed.values())
+
+    def close(self):
+        with self.lock:
+            for f in self.files.values():
+                f.close()
+            self.files = {}
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+    Optimize -- derivative free minimizers for the tuning function
+"""
+from math import sqrt
+
+GOLDEN = 0.5 * (3.0 - sqrt(5.0))
+SQRT_EPS = sqrt(2.2e-16)
+
+
+def brent(f, lower, upper, tolerance=1e-3, maxiter=100):
+    """
+    Brent's method on the interval [lower, upper]: golden section steps
+    combined with parabolic interpolation. Stops once the minimum is
+    bracketed to within tolerance (absolute in x).
+
+    Returns (x, f(x), number of function evaluations)
+    """
+    a, b = lower, upper
+    x = w = v = a + GOLDEN * (b - a)
+    fx = fw = fv = f(x)
+    evaluations = 1
+    d = e = 0.0
+
+    while evaluations < maxiter:
+        m = 0.5 * (a + b)
+        tol1 = SQRT_EPS * abs(x) + tolerance / 3.0
+        tol2 = 2.0 * tol1
+        if abs(x - m) <= tol2 - 0.5 * (b - a):
+            break
+
+        # Try a parabola through x, w and v, fall back on a golden section
+        golden = True
+        if abs(e) > tol1:
+            r = (x - w) * (fx - fv)
+            q = (x - v) * (fx - fw)
+            p = (x - v) * q - (x - w) * r
+            q = 2.0 * (q - r)
+            if q > 0.0:
+                p = -p
+            q = abs(q)
+            r, e = e, d
+            if abs(p) < abs(0.5 * q * r) and q * (a - x) < p < q * (b - x):
+                d = p / q
+                u = x + d
+                if u - a < tol2 or b - u < tol2:
+                    d = tol1 if x < m else -tol1
+                golden = False
+        if golden:
+            e = (b - x) if x < m else (a - x)
+            d = GOLDEN * e
+
+        # Never evaluate closer than tol1 to x
+        if abs(d) >= tol1:
+            u = x + d
+        else:
+            u = x + (tol1 if d > 0.0 else -tol1)
+        fu = f(u)
+        evaluations += 1
+
+        if fu <= fx:
+            if u < x:
+                b = x
+            else:
+                a = x
+            v, fv, w, fw, x, fx = w, fw, x, fx, u, fu
+        else:
+            if u < x:
+                a = u
+            else:
+                b = u
+            if fu <= fw or w == x:
+                v, fv, w, fw = w, fw, u, fu
+            elif fu <= fv or v == x or v == w:
+                v, fv = u, fu
+
+    return x, fx, evaluations
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+    Class PriorDatabase -- optima of previously tuned molecules, used to
+    start new tunings from a narrow bracket
+
+    Each tuned molecule is stored with a few descriptors: its element
+    counts, electron count and size from the geometry block, and the basis
+    and dft options. A molecule is only compared with molecules tuned with
+    the same program, basis, dft options and dimension (and alpha for 1D
+    tuning). Among those the nearest ones, by relative electron count,
+    composition and size, predict the optimum as a weighted mean, and the
+    bracket around it is twice their spread plus a margin. The tuning steps
+    fall back on the full range when the optimum lands on the edge of the
+    predicted bracket.
+"""
+from collections import namedtuple
+from hashlib import sha256
+from math import sqrt
+from os import makedirs
+from os.path import dirname, expanduser
+import json
+import sqlite3
+import threading
+import time
+
+from elements import element
+from tune_parser import geometry_lines
+
+DEFAULT_PATH = "~/.cache/tune-it/priors.sqlite"
+
+# Neighbours used for a prediction, farthest descriptor distance still
+#  counted as a relative, and the margins added to their spread
+NEIGHBOURS = 5
+MAX_DISTANCE = 0.3
+OMEGA_MARGIN = 0.05
+ALPHA_MARGIN = 0.1
+
+# Predicted (alpha, omega) and the half widths of the bracket around it,
+#  count is the number of molecules it is based on
+Prior = namedtuple(
+    "Prior", ["alpha", "omega", "alpha_width", "omega_width", "count"]
+)
+
+
+def _canonical(lines):
+    return [" ".join(x.lower().split()) for x in lines]
+
+
+def descriptors(tune):
+    """
+    Descriptors of a molecule, the class is what must match exactly for
+    two molecules to be compared
+    """
+    elements = {}
+    for atom in tune.geometry["symbols"]:
+        symbol = element(atom)
+        elements[symbol] = elements.get(symbol, 0) + 1
+    xyz = tune.geometry["coordinates"]
+    size = 0.0
+    if len(xyz):
+        extent = [max(xyz[i::3]) - min(xyz[i::3]) for i in range(3)]
+        size = sqrt(sum(x * x for x in extent))
+    alpha = None
+    if tune.tune["dimension"] == "1":
+        alpha = "{0:.4f}".format(float(tune.tune["alpha"]))
+    return {
+        "class": {
+            "program": tune.program,
+            "basis": _canonical(tune.basis["basis"]),
+            "basis_option": tune.basis["option"],
+            "ecp": _canonical(tune.ecp.get("ecp", [])),
+            "dft": _canonical(tune.dft),
+            "dimension": tune.tune["dimension"],
+            "alpha": alpha,
+        },
+        "elements": elements,
+        "electrons": tune.electrons(),
+        "atoms": len(tune.geometry["symbols"]),
+        "size": size,
+    }
+
+
+def _key(document):
+    encoded = json.dumps(document, sort_keys=True, separators=(",", ":"))
+    return sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def distance(a, b):
+    """
+    Descriptor distance, 0 for the same composition and size: relative
+    electron count difference + half the L1 distance of the element
+    fractions + relative size difference
+    """
+    d = abs(a["electrons"] - b["electrons"]) / max(a["electrons"], b["electrons"], 1)
+    d += abs(a["size"] - b["size"]) / max(a["size"], b["size"], 1.0)
+    total_a = float(sum(a["elements"].values()) or 1)
+    total_b = float(sum(b["elements"].values()) or 1)
+    for symbol in set(a["elements"]) | set(b["elements"]):
+        d += 0.5 * abs(
+            a["elements"].get(symbol, 0) / total_a
+            - b["elements"].get(symbol, 0) / total_b
+        )
+    return d
+
+
+class PriorDatabase:
+    """
+    SQLite backed record of tuned molecules, one row per molecule (its
+    geometry, charge and class), the latest tuning replaces earlier ones.
+    Safe to share between the threads of a batch.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = expanduser(path)
+        if dirname(self.path):
+            makedirs(dirname(self.path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS molecules (key TEXT PRIMARY KEY, "
+            + "class TEXT NOT NULL, descriptors TEXT NOT NULL, "
+            + "alpha REAL NOT NULL, omega REAL NOT NULL, step TEXT NOT NULL, "
+            + "name TEXT NOT NULL, tuned REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS molecules_class ON molecules (class)")
+        self.db.commit()
+
+    def record(self, tune, alpha, omega):
+        """
+        Store the optimum found for tune, the broad base grid doesn't pin
+        it down well enough to be used as a prior
+        """
+        if tune.tune["step"] == "base":
+            return
+        found = descriptors(tune)
+        key = _key(
+            {
+                "class": found["class"],
+                "geometry": _canonical(geometry_lines(tune.geometry)),
+                "charge": int(tune.charge),
+            }
+        )
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO molecules VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    _key(found["class"]),
+                    json.dumps(found),
+                    alpha,
+                    omega,
+                    tune.tune["step"],
+                    tune.name,
+                    time.time(),
+                ),
+            )
+            self.db.commit()
+
+    def predict(self, tune):
+        """
+        Prior for tune from the nearest molecules of its class, None when
+        there are none close enough
+        """
+        found = descriptors(tune)
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT descriptors, alpha, omega FROM molecules WHERE class = ?",
+                (_key(found["class"]),),
+            ).fetchall()
+        near = []
+        for other, alpha, omega in rows:
+            d = distance(found, json.loads(other))
+            if d <= MAX_DISTANCE:
+                near.append((d, alpha, omega))
+        if not near:
+            return None
+        near = sorted(near)[:NEIGHBOURS]
+
+        weights = [1.0 / (x[0] + 0.01) for x in near]
+        total = sum(weights)
+
+        def spread(values):
+            mean = sum(w * x for w, x in zip(weights, values)) / total
+            variance = sum(w * (x - mean) ** 2 for w, x in zip(weights, values))
+            return mean, sqrt(variance / total)
+
+        omega, omega_spread = spread([x[2] for x in near])
+        if tune.tune["dimension"] == "1":
+            alpha, alpha_width = float(tune.tune["alpha"]), 0.0
+        else:
+            alpha, alpha_spread = spread([x[1] for x in near])
+            alpha_width = 2.0 * alpha_spread + ALPHA_MARGIN
+        return Prior(
+            alpha, omega, alpha_width, 2.0 * omega_spread + OMEGA_MARGIN, len(near)
+        )
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""
+    QM input -- writes NWChem and Gaussian decks for a single tuning job,
+    or for a pack of jobs run by one QM program invocation
+
+    With a resource Plan (see resources) a deck sets the memory of each
+    NWChem rank, or the memory and thread count of a Gaussian job.
+
+    A packed NWChem deck sets up the geometry and basis once and follows
+    them with a charge/dft/task section per job, a packed Gaussian deck
+    chains the decks of its jobs with --Link1--. Either way each job keeps
+    its own orbitals file, so warm starts work the same as for single jobs.
+"""
+from elements import element
+from tune_parser import geometry_lines
+
+
+def job_tag(job):
+    """
+    Unique file stem for a job, e.g. h2o_a0.2000_w0.4500_q1
+    """
+    return "{0}_a{1:.4f}_w{2:.4f}_q{3}".format(
+        job.name.replace("\\", "/").split("/")[-1], job.alpha, job.omega, job.charge
+    )
+
+
+def multiplicity(tune, job):
+    """
+    We only tune closed shell molecules, so the N-1 and N+1 electron
+    systems are doublets
+    """
+    if job.charge == int(tune.charge):
+        return 1
+    return 2
+
+
+def nwchem_deck(tune, job, guess=None, plan=None):
+    """
+    NWChem input using the LRC-wPBEh functional with alpha + beta = 1,
+    guess is a movecs file to start the SCF from instead of atomic orbitals
+    """
+    tag = job_tag(job)
+    deck = ["start {0}".format(tag), 'title "{0}"'.format(tag), ""]
+    deck += _nwchem_memory(plan)
+    deck.append("charge {0}".format(job.charge))
+    deck.append("")
+    deck += _nwchem_system(tune)
+    deck += _nwchem_task(tune, job, guess)
+    return "\n".join(deck)
+
+
+def nwchem_pack_deck(tune, jobs, guesses, plan=None):
+    """
+    NWChem input running every job in turn, guesses holds the movecs file
+    (or None) for each job. Settings of the dft block persist between
+    tasks in NWChem, so every section sets all of the ones it writes
+    again, and a job without a guess asks for atomic orbitals instead of
+    inheriting the input vectors of the job before it.
+    """
+    tag = job_tag(jobs[0])
+    deck = ["start {0}".format(tag), 'title "{0}"'.format(tag), ""]
+    deck += _nwchem_memory(plan)
+    deck += _nwchem_system(tune)
+    for job, guess in zip(jobs, guesses):
+        deck += ["charge {0}".format(job.charge), ""]
+        deck += _nwchem_task(tune, job, guess)
+    return "\n".join(deck)
+
+
+def _nwchem_memory(plan):
+    """
+    Memory directive, NWChem takes the memory of each MPI rank
+    """
+    if plan is None:
+        return []
+    return ["memory total {0} mb".format(plan.memory // plan.cores), ""]
+
+
+def _nwchem_system(tune):
+    """
+    Geometry, basis and ecp blocks
+    """
+    deck = []
+    # symmetry is a directive inside the geometry block, everything else
+    #  goes on the geometry line itself
+    options = list(tune.geometry.get("option", []))
+    symmetry = []
+    if "symmetry" in options:
+        i = options.index("symmetry")
+        symmetry = options[i : i + 2]
+        del options[i : i + 2]
+    deck.append(" ".join(["geometry"] + options))
+    if symmetry:
+        deck.append("  " + " ".join(symmetry))
+    deck += ["  " + x for x in geometry_lines(tune.geometry)]
+    deck += ["end", ""]
+
+    deck.append("basis")
+    deck += _nwchem_library(tune.basis["option"], tune.basis["basis"])
+    deck += ["end", ""]
+
+    if tune.ecp:
+        deck.append("ecp")
+        deck += _nwchem_library(tune.ecp["option"], tune.ecp["ecp"])
+        deck += ["end", ""]
+    return deck
+
+
+def _nwchem_task(tune, job, guess):
+    """
+    dft block and task directive of a job
+    """
+    tag = job_tag(job)
+    deck = ["dft"]
+    deck.append("  xc xcampbe96 1.0 cpbe96 1.0 hfexch 1.0")
+    deck.append(
+        "  cam {0:.6f} cam_alpha {1:.6f} cam_beta {2:.6f}".format(
+            job.omega, job.alpha, 1.0 - job.alpha
+        )
+    )
+    deck.append("  mult {0}".format(multiplicity(tune, job)))
+    if guess:
+        deck.append("  vectors input {0} output {1}.movecs".format(guess, tag))
+    else:
+        deck.append("  vectors input atomic output {0}.movecs".format(tag))
+    deck += ["  " + x for x in tune.dft]
+    deck += ["end", "", "task dft energy", ""]
+    return deck
+
+
+def _nwchem_library(option, lines):
+    """
+    A global basis/ecp is a single line whose last word is the library name
+    """
+    lines = [x for x in lines if x[0] != "#"]
+    if option == "global":
+        return ["  * library {0}".format(lines[0].split()[-1])]
+    return ["  " + x for x in lines]
+
+
+def gaussian_deck(tune, job, guess=None, plan=None):
+    """
+    Gaussian input using LC-wPBE with omega and the short range HF
+    fraction set through IOp(3/107,3/108) and IOp(3/119,3/120), guess is a
+    checkpoint file to read the initial orbitals from
+    """
+    tag = job_tag(job)
+    w = "{0:05d}00000".format(int(round(job.omega * 10000)))
+    a = "{0:05d}00000".format(int(round(job.alpha * 10000)))
+    basis = [x for x in tune.basis["basis"] if x[0] != "#"]
+    ecp = [x for x in tune.ecp.get("ecp", []) if x[0] != "#"]
+    elements = []
+    for atom in tune.geometry["symbols"]:
+        symbol = element(atom).capitalize()
+        if symbol not in elements:
+            elements.append(symbol)
+
+    if ecp:
+        model = "genecp"
+    elif tune.basis["option"] == "global":
+        model = basis[0].split()[-1]
+    else:
+        model = "gen"
+    route = "#p LC-wPBE/{0} IOp(3/107={1},3/108={1},3/119={2},3/120={2})".format(
+        model, w, a
+    )
+
+    deck = []
+    if plan is not None:
+        deck.append("%nprocshared={0}".format(plan.cores))
+        deck.append("%mem={0}MB".format(plan.memory))
+    if guess:
+        deck.append("%oldchk={0}".format(guess))
+        route += " guess=read"
+    deck.append("%chk={0}.chk".format(tag))
+    deck.append(" ".join([route] + tune.dft))
+    deck += ["", tag, ""]
+    deck.append("{0} {1}".format(job.charge, multiplicity(tune, job)))
+    deck += geometry_lines(tune.geometry)
+    deck.append("")
+
+    if model in ["gen", "genecp"]:
+        if tune.basis["option"] == "global":
+            deck += [" ".join(elements) + " 0", basis[0].split()[-1], "****"]
+        else:
+            deck += basis
+        deck.append("")
+    if ecp:
+        if tune.ecp["option"] == "global":
+            deck += [" ".join(elements) + " 0", ecp[0].split()[-1]]
+        else:
+            deck += ecp
+        deck.append("")
+    deck.append("")
+    return "\n".join(deck)
+
+
+def gaussian_pack_deck(tune, jobs, guesses, plan=None):
+    """
+    Gaussian input running every job in turn as a --Link1-- chain, guesses
+    holds the checkpoint file (or None) for each job
+    """
+    decks = [gaussian_deck(tune, x, y, plan) for x, y in zip(jobs, guesses)]
+    return "--Link1--\n".join(decks)
+
+
+def write_deck(tune, job, path, guess=None, plan=None):
+    """
+    Write the deck for job to path in the format of tune.program
+    """
+    if tune.program == ".tune-nw":
+        deck = nwchem_deck(tune, job, guess, plan)
+    else:
+        deck = gaussian_deck(tune, job, guess, plan)
+    with open(path, "w") as f:
+        f.write(deck)
+
+
+def write_pack_deck(tune, jobs, path, guesses, plan=None):
+    """
+    Write one deck running every job of a pack to path
+    """
+    if tune.program == ".tune-nw":
+        deck = nwchem_pack_deck(tune, jobs, guesses, plan)
+    else:
+        deck = gaussian_pack_deck(tune, jobs, guesses, plan)
+    with open(path, "w") as f:
+        f.write(deck)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+"""
+    QM output -- extracts the total energy, frontier orbital eigenvalues and
+    SCF convergence from NWChem and Gaussian output files
+
+    Outputs are memory mapped and never read into memory as a whole. All
+    the values we need are printed after the last SCF iteration, so only
+    that tail is parsed; the rest of a multi-GB log is touched by a single
+    chunked count of the iteration lines (NWChem) or not at all (Gaussian).
+    LogTail and ConvergenceMonitor follow a running job to stop an SCF that
+    is going nowhere before it burns its whole iteration budget.
+
+    The output of a packed deck (see qm_input) is split at the start of
+    each task, the NWChem DFT module banner or Gaussian's Link 1, and every
+    piece is parsed like the output of a single job.
+"""
+import mmap
+import re
+
+# Markers of the NWChem SCF iteration lines and of the Gaussian tail
+NWCHEM_MARK = b",ls="
+GAUSSIAN_DONE = b"SCF Done"
+GAUSSIAN_CYCLE = b" Cycle "
+CHUNK = 1 << 24
+
+# Start of every task of a packed deck
+TASKS = {".tune-nw": "NWChem DFT Module", ".tune-g09": "Entering Link 1"}
+
+# One alternation per program, finditer reports whichever piece matched
+NWCHEM = re.compile(
+    rb"Total DFT energy =\s+(?P<energy>-?\d+\.\d+)"
+    + rb"|(?P<failed>Calculation failed to converge)"
+    + rb"|DFT Final (?P<spin>Alpha |Beta )?Molecular Orbital Analysis"
+    + rb"|Vector\s+\d+\s+Occ=(?P<occupation>\S+)\s+E=\s*(?P<eigenvalue>\S+)"
+)
+GAUSSIAN = re.compile(
+    rb"SCF Done:\s+E\(\S+\)\s+=\s+(?P<energy>-?\d+\.\d+)\s+A\.U\.\s+after\s+"
+    + rb"(?P<cycles>\d+)\s+cycles"
+    + rb"|(?P<failed>Convergence failure)"
+    + rb"|(?P<spin>Alpha|Beta)\s+(?P<kind>occ|virt)\. eigenvalues --(?P<values>.*)"
+)
+GAUSSIAN_NUMBER = re.compile(rb"-?\d+\.\d+")
+
+# SCF iteration lines, used to follow a running job
+NWCHEM_ITERATION = re.compile(r"d=\s*\d+,ls=\S+\s+(\d+)\s+(-?\d+\.\d+)\s+(\S+)")
+GAUSSIAN_ITERATION = re.compile(r"E=\s*(-?\d+\.\d+)\s+Delta-E=\s*(-?\d+\.\d+)")
+FAILURES = ["Calculation failed to converge", "Convergence failure"]
+
+
+def _fortran_float(x):
+    return float(x.replace(b"D", b"E").replace(b"d", b"e"))
+
+
+def _mapped(filename):
+    """
+    Read-only memory map of filename, None for an empty file
+    """
+    with open(filename, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None
+
+
+def _count(data, needle):
+    """
+    Occurrences of needle in a memory map, counted chunk by chunk
+    """
+    count = 0
+    overlap = len(needle) - 1
+    for start in range(0, len(data), CHUNK):
+        count += data[max(start - overlap, 0) : start + CHUNK].count(needle)
+    return count
+
+
+def _result():
+    return {
+        "energy": None,
+        "homo": None,
+        "lumo": None,
+        "converged": True,
+        "iterations": 0,
+    }
+
+
+def read_nwchem(filename):
+    """
+    Parse an NWChem DFT output, orbitals are taken from the final
+    molecular orbital analysis (alpha and beta for open shells)
+    """
+    data = _mapped(filename)
+    if data is None:
+        return _result()
+    with data:
+        return _parse_nwchem(data)
+
+
+def _parse_nwchem(data):
+    result = _result()
+    occupied = []
+    virtual = []
+    final = False
+    result["iterations"] = _count(data, NWCHEM_MARK)
+    tail = data[max(data.rfind(NWCHEM_MARK), 0) :]
+    for match in NWCHEM.finditer(tail):
+        if match.group("energy"):
+            result["energy"] = float(match.group("energy"))
+        elif match.group("failed"):
+            result["converged"] = False
+        elif match.group("occupation"):
+            if not final:
+                continue
+            eigenvalue = _fortran_float(match.group("eigenvalue"))
+            if _fortran_float(match.group("occupation")) > 0.0:
+                occupied.append(eigenvalue)
+            else:
+                virtual.append(eigenvalue)
+        else:
+            # open shells print alpha then beta, only restart on alpha
+            final = True
+            if match.group("spin") != b"Beta ":
+                occupied, virtual = [], []
+    return _frontier(result, occupied, virtual)
+
+
+def read_gaussian(filename):
+    """
+    Parse a Gaussian output, orbitals are taken from the last population
+    analysis
+    """
+    data = _mapped(filename)
+    if data is None:
+        return _result()
+    with data:
+        return _parse_gaussian(data)
+
+
+def _parse_gaussian(data):
+    result = _result()
+    occupied = []
+    virtual = []
+    previous = None
+    start = data.rfind(GAUSSIAN_DONE)
+    if start == -1:
+        # no energy, a convergence failure follows the last cycle
+        start = max(data.rfind(GAUSSIAN_CYCLE), 0)
+    for match in GAUSSIAN.finditer(data[start:]):
+        if match.group("energy"):
+            result["energy"] = float(match.group("energy"))
+            result["iterations"] = int(match.group("cycles"))
+        elif match.group("failed"):
+            result["converged"] = False
+        else:
+            spin, kind = match.group("spin"), match.group("kind")
+            # a new population analysis starts with alpha occupied
+            first = (spin, kind) == (b"Alpha", b"occ")
+            if first and previous != (b"Alpha", b"occ"):
+                occupied, virtual = [], []
+            values = GAUSSIAN_NUMBER.findall(match.group("values"))
+            values = [float(x) for x in values]
+            if kind == b"occ":
+                occupied += values
+            else:
+                virtual += values
+            previous = (spin, kind)
+    return _frontier(result, occupied, virtual)
+
+
+def _frontier(result, occupied, virtual):
+    if occupied:
+        result["homo"] = max(occupied)
+    if virtual:
+        result["lumo"] = min(virtual)
+    return result
+
+
+def read_output(filename, program):
+    """
+    Parse filename according to the tune program extension
+    """
+    if program == ".tune-nw":
+        return read_nwchem(filename)
+    return read_gaussian(filename)
+
+
+def read_tasks(filename, program, count):
+    """
+    Parse the output of a packed deck of count jobs, a list with the
+    results of each task in deck order. Tasks that never started (the
+    program stops at the first failure) are None.
+    """
+    parse = _parse_nwchem if program == ".tune-nw" else _parse_gaussian
+    marker = TASKS[program].encode("utf-8")
+    data = _mapped(filename)
+    if data is None:
+        return [None] * count
+    with data:
+        starts = []
+        start = data.find(marker)
+        while start != -1 and len(starts) < count:
+            starts.append(start)
+            start = data.find(marker, start + len(marker))
+        ends = starts[1:] + [len(data)]
+        results = [parse(data[x:y]) for x, y in zip(starts, ends)]
+    return results + [None] * (count - len(results))
+
+
+class LogTail:
+    """
+    Incrementally reads the complete lines appended to a growing file
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.offset = 0
+        self.partial = ""
+
+    def lines(self):
+        with open(self.filename, "r", errors="replace") as f:
+            f.seek(self.offset)
+            data = f.read()
+            self.offset = f.tell()
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        return lines
+
+
+class ConvergenceMonitor:
+    """
+    Watches SCF iteration lines of a running job. The SCF is considered
+    stalled when the energy change hasn't dropped by an order of magnitude
+    for stall consecutive iterations, or failed when the program says so.
+    Every task of a packed deck starts over from a fresh SCF, so the count
+    restarts with it.
+    """
+
+    def __init__(self, program, stall=30):
+        self.pattern = NWCHEM_ITERATION
+        self.delta = 3
+        if program == ".tune-g09":
+            self.pattern = GAUSSIAN_ITERATION
+            self.delta = 2
+        self.task = TASKS[program]
+        self.stall = stall
+        self.iterations = 0
+        self.best = float("inf")
+        self.improved = 0
+        self.failed = False
+
+    def update(self, line):
+        """
+        Feed one line of output, returns True once the job should be killed
+        """
+        if any(x in line for x in FAILURES):
+            self.failed = True
+            return True
+        if self.task in line:
+            self.best = float("inf")
+            self.improved = self.iterations
+            return False
+        match = self.pattern.search(line)
+        if match is None:
+            return False
+        self.iterations += 1
+        delta = abs(float(match.group(self.delta).replace("D", "E")))
+        if delta < 0.1 * self.best:
+            self.best = delta
+            self.improved = self.iterations
+        return self.iterations - self.improved >= self.stall
@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+"""
+    Class QMRunner -- runs a single tuning job, or a pack of them, through
+    NWChem or Gaussian
+"""
+from copy import copy
+from os import environ, kill, makedirs, remove
+from os.path import abspath, basename, isfile, join
+from socket import gethostname
+import shlex
+import shutil
+import signal
+import subprocess
+import time
+
+from cache import cache_key
+from qm_input import job_tag, write_deck, write_pack_deck
+from qm_output import ConvergenceMonitor, LogTail, read_output, read_tasks
+from tracer import TRACER
+from tuning import Job
+
+EXECUTABLES = {".tune-nw": "nwchem", ".tune-g09": "g09"}
+EXTENSIONS = {".tune-nw": (".nw", ".out"), ".tune-g09": (".com", ".log")}
+ORBITALS = {".tune-nw": ".movecs", ".tune-g09": ".chk"}
+
+# NWChem jobs on more than one core start through the launcher
+DEFAULT_LAUNCHER = "mpirun -np {cores}"
+
+# A probe run stops its SCF after PROBE_ITERATIONS iterations
+PROBE_ITERATIONS = 3
+PROBE = {".tune-nw": "iterations {0}", ".tune-g09": "scf=(maxcycle={0})"}
+
+
+def can_launch(launcher, executable=None):
+    """
+    Whether NWChem jobs may run on more than one core with launcher: any
+    launcher given instead of the default does, the default only when
+    mpirun is installed and wraps nwchem rather than another executable
+    """
+    if launcher != DEFAULT_LAUNCHER:
+        return bool(launcher)
+    return executable is None and shutil.which(shlex.split(launcher)[0]) is not None
+
+
+def _interruptible():
+    # pool workers ignore SIGINT (see executor), a Ctrl-C must still stop
+    #  the QM programs they run
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+
+class QMRunner:
+    """
+    Callable that writes the deck for a job, runs the QM program on it and
+    returns the extracted results. The executable can be anything that
+    behaves like nwchem (deck as argument) or g09 (deck on stdin), both
+    write their output to stdout. If guess is a finished job its converged
+    orbitals (movecs or chk) seed the SCF of this job. The output is
+    checked every poll seconds and the job killed once its SCF has gone
+    stall iterations without progress.
+
+    While the QM program runs its host and pid are kept in <tag>.pid in the
+    workdir, so any process on that host can terminate a job it no longer
+    needs (the workdir may be shared with other nodes).
+
+    pack runs several jobs with one invocation of the QM program, to pay
+    its startup and setup once. A pack uses the deck, output and pid file
+    of its first job.
+
+    With a resource Plan (see resources) every deck gets the plan's memory
+    and, for Gaussian, its thread count. NWChem jobs on more than one core
+    are started by the launcher, a command prefix in which {cores} is
+    replaced by the number of MPI ranks.
+
+    With a Scratch (see scratch) every job runs in a directory of its own
+    on node-local storage, only its output and converged orbitals come
+    back to the workdir, and warm starts read the orbitals kept on that
+    storage when they are still there.
+    """
+
+    def __init__(
+        self,
+        tune,
+        executable=None,
+        workdir=None,
+        stall=30,
+        poll=1.0,
+        plan=None,
+        launcher=DEFAULT_LAUNCHER,
+        scratch=None,
+    ):
+        self.tune = tune
+        self.program = tune.program
+        self.executable = executable or EXECUTABLES[tune.program]
+        self.workdir = abspath(workdir or tune.name + "_jobs")
+        self.stall = stall
+        self.poll = poll
+        self.plan = plan
+        self.launcher = launcher
+        self.scratch = scratch
+
+    def key(self, job):
+        executable = shutil.which(self.executable) or abspath(self.executable)
+        return cache_key(self.tune, job, executable)
+
+    def cost(self, job):
+        """
+        Relative cost of a job, the SCF scales roughly with the cube of the
+        number of electrons
+        """
+        return self.tune.electrons(job.charge) ** 3
+
+    def files(self, job):
+        """
+        Deck, output, orbitals and pid file of a job
+        """
+        tag = job_tag(job)
+        return [
+            join(self.workdir, tag + x)
+            for x in list(EXTENSIONS[self.program]) + [ORBITALS[self.program], ".pid"]
+        ]
+
+    def terminate(self, job):
+        """
+        Send SIGTERM to the running QM program of job, if there is one on
+        this host
+        """
+        try:
+            with open(self.files(job)[3], "r") as f:
+                host, pid = f.read().split()
+            if host == gethostname():
+                kill(int(pid), signal.SIGTERM)
+        except (OSError, ValueError):
+            # not started yet or already finished
+            pass
+
+    def clean(self, job):
+        """
+        Remove every file a job left in the workdir
+        """
+        for path in self.files(job):
+            if isfile(path):
+                remove(path)
+
+    def directory(self, job):
+        """
+        Directory a job (or pack) runs in, one of its own on the scratch
+        storage when there is one
+        """
+        makedirs(self.workdir, exist_ok=True)
+        if self.scratch is None:
+            return self.workdir
+        return self.scratch.job_directory(self.tune.name, job_tag(job))
+
+    def orbitals(self, guess, directory):
+        """
+        Orbitals file of the finished job guess as seen from directory, or
+        None when they are gone
+        """
+        if guess is None:
+            return None
+        name = job_tag(guess) + ORBITALS[self.program]
+        if self.scratch is not None and self.scratch.fetch(
+            self.tune.name, guess.charge, name, directory
+        ):
+            return name
+        if not isfile(join(self.workdir, name)):
+            return None
+        return name if directory == self.workdir else join(self.workdir, name)
+
+    def copy_back(self, directory, jobs, converged):
+        """
+        Copy the output of a job (or pack) run on the scratch storage and
+        the orbitals of its converged jobs to the workdir, keep those
+        orbitals in the scratch store and remove the directory
+        """
+        if directory == self.workdir:
+            return
+        try:
+            for path in self.files(jobs[0])[1:2] + [
+                self.files(x)[2] for x in converged
+            ]:
+                local = join(directory, basename(path))
+                if isfile(local):
+                    shutil.copyfile(local, path)
+            for job in converged:
+                local = join(directory, basename(self.files(job)[2]))
+                if isfile(local):
+                    self.scratch.keep(self.tune.name, job.charge, local)
+        finally:
+            self.scratch.release(directory)
+
+    def __call__(self, job, guess=None):
+        tag = job_tag(job)
+        deck, output, _, pid = self.files(job)
+        directory = self.directory(job)
+        converged = []
+        try:
+            guess = self.orbitals(guess, directory)
+            local = [join(directory, basename(x)) for x in [deck, output]]
+            fields = {"charge": job.charge, "alpha": job.alpha, "omega": job.omega}
+            with TRACER.span("deck", **fields):
+                write_deck(self.tune, job, local[0], guess, self.plan)
+
+            scf = TRACER.span("scf", warm=guess is not None, **fields)
+            with scf as scf_fields:
+                returncode, stalled = self.execute(local[0], local[1], pid, directory)
+                scf_fields["iterations"] = stalled
+
+            if stalled:
+                raise Exception(
+                    (
+                        "QM Error: SCF of {0} stopped after {1} iterations without "
+                        + "converging, see {2}"
+                    ).format(tag, stalled, output)
+                )
+            with TRACER.span("extract", **fields):
+                result = read_output(local[1], self.program)
+            # the scf span holds on to its fields, fill in the iteration count
+            scf_fields["iterations"] = result["iterations"]
+            if returncode != 0 or result["energy"] is None:
+                raise Exception(
+                    "QM Error: {0} exited with status {1}, see {2}".format(
+                        tag, returncode, output
+                    )
+                )
+            if not result["converged"]:
+                raise Exception(
+                    "QM Error: SCF did not converge, see {0}".format(output)
+                )
+            converged.append(job)
+            return result
+        finally:
+            self.copy_back(directory, [job], converged)
+
+    def pack(self, jobs, guesses):
+        """
+        Run jobs in order from a single deck, guesses holds a finished job
+        (or None) for each. A job starts from the orbitals of the previous
+        job of its charge in the pack when there is one. Returns a list
+        with the results of each job, or the exception that stopped it:
+        the QM program gives up on the rest of the deck at the first
+        failure.
+        """
+        directory = self.directory(jobs[0])
+        outcomes = []
+        try:
+            outcomes = self._pack(jobs, guesses, directory)
+            return outcomes
+        finally:
+            converged = [
+                x for x, y in zip(jobs, outcomes) if not isinstance(y, Exception)
+            ]
+            self.copy_back(directory, jobs, converged)
+
+    def _pack(self, jobs, guesses, directory):
+        """
+        Write and run the deck of a pack in directory, see pack
+        """
+        deck, output, _, pid = self.files(jobs[0])
+        local = [join(directory, basename(x)) for x in [deck, output]]
+        orbitals = []
+        previous = {}
+        for job, guess in zip(jobs, guesses):
+            if job.charge in previous:
+                guess = job_tag(previous[job.charge]) + ORBITALS[self.program]
+            else:
+                guess = self.orbitals(guess, directory)
+            orbitals.append(guess)
+            previous[job.charge] = job
+        fields = {"molecule": jobs[0].name, "jobs": len(jobs)}
+        with TRACER.span("deck", **fields):
+            write_pack_deck(self.tune, jobs, local[0], orbitals, self.plan)
+
+        warm = sum(x is not None for x in orbitals)
+        with TRACER.span("scf", warm=warm, **fields) as scf_fields:
+            returncode, stalled = self.execute(local[0], local[1], pid, directory)
+            scf_fields["iterations"] = stalled
+        with TRACER.span("extract", **fields):
+            results = read_tasks(local[1], self.program, len(jobs))
+        scf_fields["iterations"] = sum(x["iterations"] for x in results if x)
+
+        outcomes = []
+        for job, result in zip(jobs, results):
+            tag = job_tag(job)
+            if outcomes and isinstance(outcomes[-1], Exception):
+                outcomes.append(
+                    Exception(
+                        "QM Error: {0} didn't run, an earlier job of {1} failed".format(
+                            tag, deck
+                        )
+                    )
+                )
+            elif stalled and (result is None or result["energy"] is None):
+                outcomes.append(
+                    Exception(
+                        "QM Error: SCF of {0} stalled and was killed, see {1}".format(
+                            tag, output
+                        )
+                    )
+                )
+            elif result is None or result["energy"] is None:
+                outcomes.append(
+                    Exception(
+                        "QM Error: {0} exited with status {1} during {2}, see {3}".format(
+                            job_tag(jobs[0]), returncode, tag, output
+                        )
+                    )
+                )
+            elif not result["converged"]:
+                outcomes.append(
+                    Exception(
+                        "QM Error: SCF of {0} did not converge, see {1}".format(
+                            tag, output
+                        )
+                    )
+                )
+            else:
+                outcomes.append(result)
+        return outcomes
+
+    def probe(self, plan):
+        """
+        Wall time of a short SCF of the neutral molecule, at a point in the
+        middle of the base grid, run with plan. Its files go to a probe
+        directory of the workdir and are removed afterwards.
+        """
+        tune = copy(self.tune)
+        tune.dft = list(self.tune.dft) + [PROBE[self.program].format(PROBE_ITERATIONS)]
+        runner = QMRunner(
+            tune,
+            self.executable,
+            join(self.workdir, "probe"),
+            self.stall,
+            self.poll,
+            plan,
+            self.launcher,
+            self.scratch,
+        )
+        points = tune.grid("base")
+        alpha, omega = points[len(points) // 2]
+        job = Job(tune.name, alpha, omega, int(tune.charge))
+        start = time.perf_counter()
+        try:
+            runner(job)
+        except Exception:
+            # the SCF is not meant to converge in so few iterations
+            pass
+        elapsed = time.perf_counter() - start
+        runner.clean(job)
+        return elapsed
+
+    def command(self, deck):
+        """
+        Command line running the QM program, NWChem reads the deck named on
+        its command line and Gaussian reads it from stdin
+        """
+        if self.program != ".tune-nw":
+            return [self.executable]
+        command = [self.executable, deck]
+        if self.plan is not None and self.plan.cores > 1 and self.launcher:
+            command = shlex.split(self.launcher.format(cores=self.plan.cores)) + command
+        return command
+
+    def execute(self, deck, output, pid, directory=None):
+        """
+        Run the QM program on deck in directory (the workdir by default),
+        keeping its pid in the pid file while it runs. Returns its exit
+        status and the SCF iteration it was killed at (0 unless it
+        stalled, see watch).
+        """
+        directory = directory or self.workdir
+        env = None
+        if directory != self.workdir and self.program != ".tune-nw":
+            # Gaussian's rwf and other scratch files
+            env = dict(environ, GAUSS_SCRDIR=directory)
+        with open(output, "w") as out, open(deck, "r") as inp:
+            process = subprocess.Popen(
+                self.command(deck),
+                stdin=None if self.program == ".tune-nw" else inp,
+                stdout=out,
+                cwd=directory,
+                env=env,
+                preexec_fn=_interruptible,
+            )
+            with open(pid, "w") as f:
+                f.write("{0} {1}".format(gethostname(), process.pid))
+            try:
+                stalled = self.watch(process, output)
+            finally:
+                remove(pid)
+        return process.returncode, stalled
+
+    def watch(self, process, output):
+        """
+        Follow the output of a running job and kill it as soon as its SCF
+        fails or stalls. Returns the SCF iteration it was killed at, or 0
+        once the job has exited by itself.
+        """
+        tail = LogTail(output)
+        monitor = ConvergenceMonitor(self.program, self.stall)
+        while True:
+            try:
+                process.wait(timeout=self.poll)
+                return 0
+            except subprocess.TimeoutExpired:
+                pass
+            if any(monitor.update(x) for x in tail.lines()):
+                process.kill()
+                process.wait()
+                return max(monitor.iterations, 1)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+"""
+    Resources -- splits the cores and memory of a node between concurrent
+    QM jobs
+
+    The size of a job is its number of basis functions N, counted from the
+    geometry and the basis block. Its memory follows the replicated data
+    layout of both programs, a few dozen N x N matrices on top of a fixed
+    base: per MPI rank for NWChem, per job (shared by its threads) for
+    Gaussian. Its speedup on c cores follows Amdahl's law with a parallel
+    fraction that grows with N, or that a probe run has measured.
+
+    make_plan tries every cores-per-job count and keeps the one with the most
+    SCF jobs finished per unit of time, counting only the jobs the tuning
+    step can actually run at once and as many of them as fit in the node's
+    memory cap.
+"""
+from collections import namedtuple
+from os import sysconf
+import re
+
+from elements import atomic_number, element
+
+# Jobs run at once, cores (MPI ranks or threads) and MB of memory of each
+#  job, and the basis functions and parallel fraction the plan is based on
+Plan = namedtuple("Plan", ["jobs", "cores", "memory", "functions", "fraction"])
+
+# Last atomic number of each row of the periodic table: H-He, Li-Ne, Na-Ar,
+#  K-Ca, Sc-Zn, Ga-Kr, anything heavier
+ROWS = [2, 10, 18, 20, 30, 36]
+
+# Basis functions per element of each row
+POPLE = {
+    "sto-3": (1, 5, 9, 13, 18, 27, 36),
+    "3-21": (2, 9, 13, 17, 29, 23, 33),
+    "6-31": (2, 9, 13, 17, 29, 23, 33),
+    "6-311": (3, 13, 21, 25, 39, 33, 43),
+}
+DUNNING = {
+    "d": (5, 14, 18, 27, 43, 27, 43),
+    "t": (14, 30, 34, 43, 68, 50, 68),
+    "q": (30, 55, 59, 70, 105, 80, 105),
+    "5": (55, 91, 95, 110, 151, 120, 151),
+}
+AUGMENTED = {
+    "d": (4, 9, 9, 9, 16, 9, 16),
+    "t": (9, 16, 16, 16, 25, 16, 25),
+    "q": (16, 25, 25, 25, 36, 25, 36),
+    "5": (25, 36, 36, 36, 49, 36, 49),
+}
+LIBRARIES = {
+    "def2-svp": (5, 14, 18, 23, 32, 23, 32),
+    "def2-tzvp": (6, 31, 37, 37, 58, 45, 58),
+    "def2-tzvpp": (14, 31, 37, 37, 58, 45, 58),
+    "def2-qzvp": (30, 57, 66, 70, 106, 80, 106),
+    "def2-qzvpp": (30, 57, 66, 70, 106, 80, 106),
+}
+# Polarized double zeta, for libraries we don't know
+DEFAULT = (5, 15, 19, 25, 35, 35, 40)
+
+# Functions of a shell, spherical
+SHELLS = {"s": 1, "p": 3, "d": 5, "f": 7, "g": 9, "h": 11, "sp": 4, "l": 4}
+
+# MB of the fixed part of a job, 8 byte N x N matrices held by an NWChem
+#  rank and by a Gaussian job (plus per thread), and the N at which half
+#  of the SCF runs in parallel
+BASE_MEMORY = 300
+NWCHEM_MATRICES = 30
+GAUSSIAN_MATRICES = 20
+THREAD_MATRICES = 2
+HALF_PARALLEL = 100
+
+
+def _row(z):
+    return sum(z > x for x in ROWS)
+
+
+def _pople(name, z):
+    found = re.match(r"^(sto-3|3-21|6-311|6-31)(\+{0,2})g(\*{0,2})(?:\((.*)\))?$", name)
+    if found is None:
+        return None
+    base, diffuse, stars, extra = found.groups()
+    row = _row(z)
+    count = POPLE[base][row]
+    # 6-31G* and smaller use cartesian d functions
+    d = 5 if base == "6-311" else 6
+    if row > 0:
+        count += 4 if diffuse else 0
+        count += d if stars else 0
+    else:
+        count += 1 if len(diffuse) == 2 else 0
+        count += 3 if len(stars) == 2 else 0
+    if extra:
+        heavy, _, light = extra.partition(",")
+        for shell in re.findall(r"(\d*)([pdf])", heavy if row > 0 else light):
+            size = {"p": 3, "d": d, "f": 10 if d == 6 else 7}[shell[1]]
+            count += int(shell[0] or 1) * size
+    return count
+
+
+def library_functions(name, z):
+    """
+    Basis functions of element z in the named basis library, a polarized
+    double zeta guess for libraries we don't know
+    """
+    name = name.lower().strip("\"'")
+    count = _pople(name, z)
+    if count is not None:
+        return count
+    found = re.match(r"^(aug-)?cc-pc?v([dtq5])z$", name)
+    if found:
+        count = DUNNING[found.group(2)][_row(z)]
+        if found.group(1):
+            count += AUGMENTED[found.group(2)][_row(z)]
+        return count
+    return LIBRARIES.get(name, DEFAULT)[_row(z)]
+
+
+def _element_functions(option, lines):
+    """
+    Functions per element of a basis block, from library names or explicit
+    shells (NWChem or Gaussian format)
+    """
+    lines = [x.split() for x in lines if x.strip() and x[0] != "#"]
+    if option == "global":
+        return {None: lines[0][-1]}
+    found = {}
+    current = []
+    for words in lines:
+        if len(words) >= 3 and words[1].lower() == "library":
+            found[element(words[0])] = words[-1]
+        elif len(words) == 2 and words[1].lower() in SHELLS:
+            # NWChem shell header, "c s"
+            symbol = element(words[0])
+            if isinstance(found.get(symbol), str):
+                found[symbol] = 0
+            found[symbol] = found.get(symbol, 0) + SHELLS[words[1].lower()]
+        elif words[0] == "****":
+            current = []
+        elif words[-1] == "0" and len(words) > 1 and not current:
+            # Gaussian element line, "C H 0", then a library or shells
+            current = [element(x) for x in words[:-1]]
+        elif current and words[0].lower() in SHELLS and len(words) >= 2:
+            for symbol in current:
+                if isinstance(found.get(symbol), str):
+                    found[symbol] = 0
+                found[symbol] = found.get(symbol, 0) + SHELLS[words[0].lower()]
+        elif current and len(words) == 1:
+            for symbol in current:
+                found[symbol] = words[0]
+    return found
+
+
+def basis_functions(tune):
+    """
+    Number of basis functions of the molecule of tune
+    """
+    found = _element_functions(tune.basis["option"], tune.basis["basis"])
+    count = 0
+    for atom in tune.geometry["symbols"]:
+        functions = found.get(element(atom), found.get(None))
+        if functions is None or isinstance(functions, str):
+            functions = library_functions(functions or "", atomic_number(atom))
+        count += functions
+    return count
+
+
+def job_memory(program, functions, cores):
+    """
+    MB a job needs on cores, all of its NWChem ranks together
+    """
+    matrix = 8.0 * functions * functions / 1e6
+    if program == ".tune-nw":
+        return cores * (BASE_MEMORY + NWCHEM_MATRICES * matrix)
+    return BASE_MEMORY + (GAUSSIAN_MATRICES + THREAD_MATRICES * cores) * matrix
+
+
+def parallel_fraction(functions):
+    """
+    Share of an SCF that runs in parallel, small molecules spend most of
+    their time in startup, setup and serial linear algebra
+    """
+    return functions / float(functions + HALF_PARALLEL)
+
+
+def speedup(fraction, cores):
+    return 1.0 / ((1.0 - fraction) + fraction / cores)
+
+
+def measured_fraction(serial, parallel, cores):
+    """
+    Parallel fraction from the wall times of the same job on 1 and cores
+    """
+    if cores < 2 or parallel <= 0:
+        return 0.0
+    gain = serial / parallel
+    return min(max((1.0 - 1.0 / gain) / (1.0 - 1.0 / cores), 0.0), 0.999)
+
+
+def calibrate(runner, cores, memory):
+    """
+    Parallel fraction of the molecule of a QMRunner, from the wall times of
+    probe runs on one core and on cores (returned along with it)
+    """
+    functions = basis_functions(runner.tune)
+    serial = runner.probe(Plan(1, 1, memory, functions, None))
+    parallel = runner.probe(Plan(1, cores, memory, functions, None))
+    return measured_fraction(serial, parallel, cores), serial, parallel
+
+
+def node_memory():
+    """
+    MB of physical memory of this node
+    """
+    return sysconf("SC_PAGE_SIZE") * sysconf("SC_PHYS_PAGES") // 2**20
+
+
+def make_plan(
+    tunes, cores, memory, jobs=None, cores_per_job=None, parallel=None, fraction=None
+):
+    """
+    Plan for running the jobs of tunes on a node with cores and memory MB.
+    The largest molecule sizes every job. jobs and cores_per_job fix those
+    counts, parallel is the most jobs the tuning can run at once (None when
+    there is always more work) and fraction replaces the modelled parallel
+    fraction. Every job gets an even share of the memory.
+    """
+    largest = max(tunes, key=basis_functions)
+    functions = basis_functions(largest)
+    if fraction is None:
+        fraction = parallel_fraction(functions)
+    program = largest.program
+
+    best = None
+    candidates = [cores_per_job]
+    if not cores_per_job:
+        candidates = range(1, max(cores // (jobs or 1), 1) + 1)
+    for count in candidates:
+        need = job_memory(program, functions, count)
+        fit = int(memory // need)
+        running = jobs or min(max(cores // count, 1), parallel or cores)
+        if fit < running:
+            if jobs:
+                continue
+            running = fit
+        if running < 1:
+            continue
+        rate = min(running, parallel or running) * speedup(fraction, count)
+        # more cores only when they pay off
+        if best is None or rate > 1.01 * best[0]:
+            best = (rate, running, count)
+    if best is None:
+        raise Exception(
+            (
+                "Resource Error: the jobs of {0} ({1} basis functions) need "
+                + "{2:.0f} MB, more than the {3} MB available"
+            ).format(
+                largest.name,
+                functions,
+                job_memory(program, functions, cores_per_job or 1) * (jobs or 1),
+                memory,
+            )
+        )
+    _, running, count = best
+    return Plan(running, count, int(memory // running), functions, fraction)
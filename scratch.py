@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+    Class Scratch -- isolated directories for QM jobs on fast node-local
+    storage, and a store of orbitals reused between jobs
+
+    Every job runs in a directory of its own under root (a tmpfs, /scratch
+    or any local disk), so concurrent jobs never fight over the shared
+    filesystem and whatever the QM program writes besides its output
+    (integrals, grids, runtime databases, Gaussian's rwf files) goes away
+    with the directory. Only the output, and the orbitals of the jobs that
+    converged, are copied back to the workdir.
+
+    Those orbitals also stay on the local storage, in a store per molecule
+    and charge state: the next omega point of that charge starts from a
+    hard link to them instead of reading them back from the shared
+    filesystem. The store is kept under a disk usage cap by removing its
+    least recently used files, along with the directories of jobs whose
+    process died without cleaning up.
+"""
+from hashlib import sha256
+from os import (
+    getpid,
+    kill,
+    link,
+    listdir,
+    makedirs,
+    remove,
+    replace,
+    stat,
+    utime,
+    walk,
+)
+from os.path import abspath, basename, isdir, isfile, join
+from socket import gethostname
+import fcntl
+import re
+import shutil
+import time
+
+# MB of local storage used at most, unless given
+DEFAULT_SIZE = 10000
+
+# Seconds between two enforcements of the cap by the same process
+ENFORCE = 30.0
+
+
+def _alive(pid):
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # someone else's process
+        pass
+    return True
+
+
+class Scratch:
+    """
+    Scratch space under root/tune-it, size is the cap in MB of everything
+    in it. Picklable, so workers in other processes and on other nodes
+    each use their own local storage at the same path.
+    """
+
+    def __init__(self, root, size=DEFAULT_SIZE):
+        self.root = join(abspath(root), "tune-it")
+        self.size = size
+        self.enforced = 0.0
+
+    def _molecule(self, name):
+        # inputs of a batch may share a name in different directories
+        digest = sha256(abspath(name).encode("utf-8")).hexdigest()[:8]
+        return join(self.root, "{0}_{1}".format(basename(name), digest))
+
+    def _store(self, name, charge):
+        return join(self._molecule(name), "q{0}".format(charge))
+
+    def job_directory(self, name, tag):
+        """
+        Fresh, empty directory for a run of job tag of molecule name,
+        release removes it
+        """
+        directory = join(
+            self._molecule(name), "jobs", gethostname(), str(getpid()), tag
+        )
+        if isdir(directory):
+            shutil.rmtree(directory)
+        makedirs(directory)
+        return directory
+
+    def release(self, directory):
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def keep(self, name, charge, path):
+        """
+        Move the orbitals file at path (in a job directory) to the store of
+        molecule name and charge
+        """
+        store = self._store(name, charge)
+        makedirs(store, exist_ok=True)
+        target = join(store, basename(path))
+        replace(path, target)
+        utime(target)
+        if time.time() - self.enforced > ENFORCE:
+            self.enforce()
+
+    def fetch(self, name, charge, filename, directory):
+        """
+        Hard link the stored orbitals file filename into directory, False
+        when the store doesn't have it (any more)
+        """
+        source = join(self._store(name, charge), filename)
+        target = join(directory, filename)
+        try:
+            link(source, target)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            # no hard links on this filesystem
+            try:
+                shutil.copyfile(source, target)
+                utime(source)
+            except FileNotFoundError:
+                # evicted in the meantime, the copy (if any) is still good
+                return isfile(target)
+            return True
+        # most recently used, the link is the stored file itself and may
+        #  already be all that is left of it
+        utime(target)
+        return True
+
+    def enforce(self):
+        """
+        Remove directories of dead jobs of this host, then the least
+        recently used stored orbitals until the usage is under the cap.
+        Running jobs are never touched, they may keep it over the cap.
+        Called after keep at most every ENFORCE seconds, a single walk
+        of root finds both.
+        """
+        makedirs(self.root, exist_ok=True)
+        self.enforced = time.time()
+        with open(join(self.root, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            host = gethostname()
+            seen = set()
+            usage = 0
+            stored = []
+            for path, directories, files in walk(self.root):
+                if basename(path) == "jobs" and host in directories:
+                    # jobs/<host>/<pid>/<tag>, removed before walk lists them
+                    processes = join(path, host)
+                    for x in listdir(processes):
+                        if not _alive(int(x)):
+                            shutil.rmtree(join(processes, x), ignore_errors=True)
+                store = re.match(r"^q-?\d+$", basename(path)) is not None
+                for x in files:
+                    try:
+                        found = stat(join(path, x))
+                    except FileNotFoundError:
+                        continue
+                    if (found.st_dev, found.st_ino) not in seen:
+                        seen.add((found.st_dev, found.st_ino))
+                        usage += found.st_size
+                    if store:
+                        stored.append((found.st_mtime, found.st_size, join(path, x)))
+            usage /= 2.0**20
+            if usage <= self.size:
+                return
+            for _, size, path in sorted(stored):
+                try:
+                    remove(path)
+                except FileNotFoundError:
+                    continue
+                usage -= size / 2.0**20
+                if usage <= self.size:
+                    break
+
@@ -0,0 +1,24 @@
+from os.path import abspath, dirname, join
+import shutil
+import sys
+
+import pytest
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+from Tune import Tune  # noqa: E402
+
+MOCK = join(ROOT, "benchmarks", "mock_qm.py")
+
+
+@pytest.fixture
+def tune(tmp_path, monkeypatch):
+    """
+    h2o.tune-nw in a directory of its own, run by benchmarks/mock_qm.py
+    without latency or failures unless a test sets them
+    """
+    for name in ["LATENCY", "STARTUP", "FAILURE"]:
+        monkeypatch.delenv("MOCK_QM_" + name, raising=False)
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(join(ROOT, "h2o.tune-nw"), tmp_path)
+    return Tune(str(tmp_path / "h2o.tune-nw"))
@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from conftest import MOCK
+from executor import JobExecutor
+from journal import Journal
+from qm_runner import QMRunner
+from tuning import point_jobs
+
+POINTS = [(0.2, 0.3), (0.2, 0.4)]
+
+
+def jobs_of(tune, points=POINTS):
+    return [x for point in points for x in point_jobs(tune, *point)]
+
+
+def test_result_per_job(tune):
+    jobs = jobs_of(tune)
+    with JobExecutor(QMRunner(tune, executable=MOCK), 2) as executor:
+        results = executor.run(jobs)
+    assert set(results) == set(jobs)
+    assert all(x["energy"] is not None for x in results.values())
+
+
+def test_cancel(tune, monkeypatch):
+    # a job takes about a second
+    monkeypatch.setenv("MOCK_QM_LATENCY", "0.05")
+    jobs = jobs_of(tune)
+    runner = QMRunner(tune, executable=MOCK, poll=0.1)
+    with JobExecutor(runner, 1, warm_start=False) as executor:
+        start = time.time()
+        state = executor.start(jobs)
+        while executor.load()[0] == 0:
+            time.sleep(0.01)
+        executor.cancel(state)
+        executor.drain(tune.name)
+        assert executor.load() == (0, 0)
+        assert time.time() - start < 3.0
+    assert state.cancelled
+    assert len(state.results) < len(jobs)
+
+
+def test_journal_replay(tune, monkeypatch):
+    jobs = jobs_of(tune)
+    journal = Journal()
+    with JobExecutor(QMRunner(tune, executable=MOCK), 2, journal=journal) as executor:
+        first = executor.run(jobs)
+    journal.close()
+
+    # every job would fail if it reached the pool again
+    monkeypatch.setenv("MOCK_QM_FAILURE", "1.0")
+    journal = Journal(resume=True)
+    with JobExecutor(QMRunner(tune, executable=MOCK), 2, journal=journal) as executor:
+        second = executor.run(jobs)
+        with pytest.raises(Exception, match="QM Error"):
+            executor.run(jobs_of(tune, [(0.2, 0.5)]))
+    journal.close()
+    assert journal.replayed() == len(jobs)
+    assert second == first
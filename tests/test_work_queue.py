@@ -0,0 +1,55 @@
+import threading
+import time
+
+from conftest import MOCK
+from executor import JobExecutor
+from qm_runner import QMRunner
+from tuning import point_jobs
+from work_queue import WorkQueue, work
+
+
+def worker(path, counts):
+    thread = threading.Thread(
+        target=lambda: counts.append(work(path, poll=0.05)), daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def test_work_runs_published_jobs(tune, tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    jobs = point_jobs(tune, 0.2, 0.3) + point_jobs(tune, 0.2, 0.4)
+    counts = []
+    with JobExecutor(QMRunner(tune, executable=MOCK), 2, work_queue=path) as executor:
+        thread = worker(path, counts)
+        results = executor.run(jobs)
+    # the worker stops once the session is closed
+    thread.join(10.0)
+    assert set(results) == set(jobs)
+    assert counts == [len(jobs)]
+
+
+def test_expired_lease_is_reissued(tune, tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    jobs = point_jobs(tune, 0.2, 0.3)
+    counts = []
+    with JobExecutor(
+        QMRunner(tune, executable=MOCK), 1, warm_start=False, work_queue=path
+    ) as executor:
+        state = executor.start(jobs)
+        # a worker that claims the first job and dies
+        queue = WorkQueue(path)
+        claimed = None
+        while claimed is None:
+            claimed = queue.claim("dead", lease=0.1)
+            time.sleep(0.01)
+        time.sleep(0.2)
+        thread = worker(path, counts)
+        executor.wait([state])
+        results = executor.result(state)
+        # the task went to the live worker, the dead one lost its lease
+        assert not queue.renew(claimed[0], "dead")
+        queue.close()
+    thread.join(10.0)
+    assert set(results) == set(jobs)
+    assert counts == [len(jobs)]
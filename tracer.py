@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+    Tracer -- span recording for the tuning pipeline
+
+    A span is a named interval with a few fields (charge, alpha, omega, SCF
+    iterations, ...). Recording one is a tuple append, so tracing is always
+    on; spans are only written out or summarized on request. Worker
+    processes hand their spans back to the parent with each job result.
+"""
+from collections import namedtuple
+from contextlib import contextmanager
+from os import getpid
+import json
+import threading
+import time
+
+Span = namedtuple("Span", ["name", "start", "end", "pid", "tid", "fields"])
+
+
+class Tracer:
+    def __init__(self):
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, **fields):
+        """
+        Record the enclosed block. The span keeps the yielded fields, so
+        they may be added to inside the block or once it is done
+        """
+        start = time.time()
+        try:
+            yield fields
+        finally:
+            self.spans.append(
+                Span(name, start, time.time(), getpid(), threading.get_ident(), fields)
+            )
+
+    def add(self, name, start, end, **fields):
+        self.spans.append(
+            Span(name, start, end, getpid(), threading.get_ident(), fields)
+        )
+
+    def extend(self, spans):
+        self.spans.extend(Span(*x) for x in spans)
+
+    def take(self):
+        """
+        Remove and return every span recorded so far
+        """
+        spans, self.spans = self.spans, []
+        return spans
+
+
+# One tracer per process
+TRACER = Tracer()
+
+
+def write_trace(filename, spans):
+    """
+    Chrome trace format (chrome://tracing, Perfetto) for a .json filename,
+    one JSON object per span and line otherwise
+    """
+    with open(filename, "w") as f:
+        if filename.endswith(".json"):
+            events = [
+                {
+                    "name": x.name,
+                    "ph": "X",
+                    "ts": x.start * 1e6,
+                    "dur": (x.end - x.start) * 1e6,
+                    "pid": x.pid,
+                    "tid": x.tid,
+                    "args": x.fields,
+                }
+                for x in spans
+            ]
+            json.dump({"traceEvents": events}, f)
+        else:
+            for x in spans:
+                f.write(json.dumps(x._asdict()) + "\n")
+
+
+def summary(spans):
+    """
+    Where the time went: count, total, mean and max duration per span name.
+    Spans of concurrent jobs overlap, so totals can exceed the wall time.
+    """
+    if not spans:
+        return ["Profile: nothing recorded"]
+    wall = max(x.end for x in spans) - min(x.start for x in spans)
+    lines = ["Profile: {0:.3f} s wall".format(wall)]
+    lines.append(
+        "{0:<12} {1:>8} {2:>12} {3:>12} {4:>12}".format(
+            "span", "count", "total s", "mean s", "max s"
+        )
+    )
+    names = []
+    durations = {}
+    for x in spans:
+        if x.name not in durations:
+            names.append(x.name)
+        durations.setdefault(x.name, []).append(x.end - x.start)
+    for name in names:
+        total = sum(durations[name])
+        lines.append(
+            "{0:<12} {1:8d} {2:12.3f} {3:12.4f} {4:12.4f}".format(
+                name,
+                len(durations[name]),
+                total,
+                total / len(durations[name]),
+                max(durations[name]),
+            )
+        )
+    iterations = [x.fields["iterations"] for x in spans if "iterations" in x.fields]
+    if iterations:
+        lines.append(
+            "SCF iterations: {0} total, {1:.1f} per job".format(
+                sum(iterations), sum(iterations) / len(iterations)
+            )
+        )
+    return lines
@@ -3,48 +3,382 @@
 Usage:
     tune-it.py [options]
         (-i <input.tune> | --input <input.tune>)
+    tune-it.py [options]
+        (-b <inputs> | --batch <inputs>)
+    tune-it.py worker [options]
+    tune-it.py daemon [options]
+    tune-it.py status [options]
+    tune-it.py stop [options]
 
 Positional Arguments:
     -i, --input <input.tune>    A tuning input file for NWChem (input.tune-nw)
                                     or Gaussian (input.tune-g09)
+    -b, --batch <inputs>        A directory of tuning input files, or a
+                                    manifest listing one input per line
+    worker                      Run the SCF jobs published to the --queue of
+                                    a tune-it.py run, on any node that sees
+                                    the queue file and the inputs' directory
+    daemon                      Keep the workers, caches and job queue of
+                                    this node alive and take tunings from
+                                    tune-it.py runs over --socket, with the
+                                    options given here
+    status                      Print the tunings of the daemon on --socket
+    stop                        Stop the daemon on --socket once its running
+                                    tunings are over
 
 Options:
     -h, --help                  Print this screen and exit
     -v, --version               Print the version of tune-it.py
+    -n, --workers <n>           Number of QM jobs to run concurrently, or to
+                                    publish at once with --queue, by default
+                                    as many as the resource plan fits on the
+                                    node [default: planned]
+    --cores <n>                 Cores of the node, or of each worker node
+                                    when jobs go to a queue
+                                    [default: all cores]
+    --cores-per-job <n>         MPI ranks (NWChem) or threads (Gaussian) of
+                                    each QM job, auto picks the count with
+                                    the best throughput for the molecules'
+                                    size (1 for a daemon, and for NWChem
+                                    unless mpirun is installed and runs
+                                    nwchem, or a launcher is given)
+                                    [default: auto]
+    --memory <MB>               Memory of the node shared by the concurrent
+                                    QM jobs, each deck gets its share
+                                    [default: 90% of RAM]
+    --launcher <cmd>            Command prefix starting NWChem on {cores} MPI
+                                    ranks [default: mpirun -np {cores}]
+    --probe                     Time a short SCF on one and on all cores to
+                                    calibrate the resource plan
+    --queue <file>              Publish the SCF jobs to a work queue file for
+                                    tune-it.py worker processes instead of
+                                    running them here
+    --idle <s>                  Worker: also exit after s seconds without a
+                                    job, not only once the run is over
+    -e, --executable <path>     QM program to run instead of nwchem or g09
+    --cache <file>              Result cache shared between runs
+                                    [default: ~/.cache/tune-it/results.sqlite]
+    --cache-size <n>            Maximum number of cached SCF results
+                                    [default: 100000]
+    --no-cache                  Neither read nor write the result cache
+    --priors <file>             Optima of earlier tunings, used to start from
+                                    a narrow bracket
+                                    [default: ~/.cache/tune-it/priors.sqlite]
+    --no-priors                 Neither use nor record earlier optima
+    --resume                    Continue an interrupted run from the journal
+                                    next to each input
+    --no-warm-start             Start every SCF from the atomic guess instead
+                                    of a neighbouring point's orbitals
+    --pack <n>                  Run up to n SCF jobs (charge states and
+                                    neighbouring points) from a single deck,
+                                    to pay the QM program's startup once
+                                    [default: 1]
+    --scratch <dir>             Run every QM job in a directory of its own
+                                    on fast node-local storage (tmpfs,
+                                    /scratch), copying back only outputs
+                                    and orbitals
+    --scratch-size <MB>         Disk usage cap of the scratch storage, the
+                                    least recently used orbitals kept there
+                                    for warm starts go first [default: 10000]
+    --stall <n>                 Kill an SCF after n iterations without
+                                    progress [default: 30]
+    --exhaustive                Evaluate every grid point, even those that
+                                    can no longer hold the minimum
+    -o, --output <file>         Also write the batch results table to file
+    --socket <file>             Unix socket of the tune-it.py daemon, runs of
+                                    an input or batch go to the daemon
+                                    listening there and it tunes them with
+                                    its own options (a run given any other
+                                    than -o or --exhaustive is refused)
+                                    [default: ~/.cache/tune-it/daemon.sock]
+    --local                     Run here even when a daemon is listening
+    --no-wait                   Only submit the run to the daemon, follow it
+                                    with tune-it.py status
+    --trace <file>              Write every timed span, as Chrome trace events
+                                    for a .json file, JSON lines otherwise
+    --profile                   Print where the time went
 """
 
 
-# Imports
+# Imports, the tuning machinery is loaded further down once no daemon takes
+#  the run
 from docopt import docopt
 from sys import exit
-from os.path import isfile, splitext
-from Tune import Tune
+from os.path import abspath, exists
+from client import listening, request
+from work_queue import work
 
+# Options a daemon's client passes on, the daemon tunes with its own options
+#  otherwise
+CLIENT = [
+    "--input",
+    "--batch",
+    "--output",
+    "--exhaustive",
+    "--socket",
+    "--local",
+    "--no-wait",
+    "--help",
+    "--version",
+]
 
 # Begin our script
 try:
     # docopt parses command line options via doc string above
     arguments = docopt(__doc__, version="tune-it.py version 0.0.1")
 
-    # Read input file
-    if not isfile(arguments["--input"]) or splitext(arguments["--input"])[-1] not in [
-        ".tune-nw",
-        ".tune-g09",
-    ]:
-        raise Exception(
-            (
-                "Input Error: {} doesn't exist or doesn't have the "
-                + "expected extension, try -h/--help"
-            ).format(arguments["--input"])
+    # Worker of another tune-it.py run, until that run is over
+    if arguments["worker"]:
+        if not arguments["--queue"]:
+            raise Exception("Input Error: a worker needs a --queue, try -h/--help")
+        idle = arguments["--idle"]
+        count = work(arguments["--queue"], float(idle) if idle else None)
+        print("Worker: {0} jobs run".format(count))
+        exit(0)
+
+    # A daemon listening on --socket takes the run, this is then only its
+    #  client
+    socket = arguments["--socket"]
+    if arguments["status"] or arguments["stop"]:
+        command = "status" if arguments["status"] else "stop"
+        print("\n".join(request(socket, {"command": command})["report"]))
+        exit(0)
+    if not arguments["daemon"] and not arguments["--local"] and listening(socket):
+        defaults = docopt(__doc__, argv=["status"])
+        ignored = [
+            x
+            for x in arguments
+            if x.startswith("-") and x not in CLIENT and arguments[x] != defaults[x]
+        ]
+        if ignored:
+            raise Exception(
+                (
+                    "Daemon Error: the daemon on {0} tunes with its own options "
+                    + "and can't honour {1}, run with --local to use them"
+                ).format(socket, ", ".join(sorted(ignored)))
+            )
+        if arguments["--output"] and arguments["--no-wait"]:
+            raise Exception(
+                "Input Error: -o/--output needs the results, drop --no-wait"
+            )
+        print("Daemon: tuning on the daemon listening on {0}".format(socket))
+        message = {
+            "command": "submit",
+            "exhaustive": arguments["--exhaustive"],
+            "wait": not arguments["--no-wait"],
+        }
+        if arguments["--batch"]:
+            message["batch"] = abspath(arguments["--batch"])
+        else:
+            message["inputs"] = [abspath(arguments["--input"])]
+        table = request(socket, message)["report"]
+        print("\n".join(table))
+        if arguments["--batch"] and arguments["--output"]:
+            with open(arguments["--output"], "w") as f:
+                f.write("\n".join(table) + "\n")
+        exit(0)
+
+    from math import ceil
+    from os import cpu_count
+    from analysis import estimate
+    from batch import (
+        BatchRunner,
+        molecule_report,
+        prior_line,
+        read_input,
+        read_manifest,
+        results_table,
+        tune_all,
+    )
+    from cache import ResultCache
+    from daemon import DaemonRunner, TuneDaemon
+    from executor import JobExecutor
+    from journal import Journal
+    from qm_runner import QMRunner, can_launch
+    from tracer import TRACER, summary, write_trace
+    from priors import PriorDatabase
+    from resources import basis_functions, calibrate, make_plan, node_memory
+    from scratch import Scratch
+    from tuning import optimum, tune_molecule
+
+    workers = None
+    if arguments["--workers"] != "planned":
+        workers = int(arguments["--workers"])
+    stall = int(arguments["--stall"])
+    pack = int(arguments["--pack"])
+    launcher = arguments["--launcher"]
+    warm_start = not arguments["--no-warm-start"]
+    scratch = None
+    if arguments["--scratch"]:
+        scratch = Scratch(arguments["--scratch"], int(arguments["--scratch-size"]))
+    cache = None
+    if not arguments["--no-cache"]:
+        cache = ResultCache(arguments["--cache"], int(arguments["--cache-size"]))
+    priors = None
+    if not arguments["--no-priors"]:
+        priors = PriorDatabase(arguments["--priors"])
+
+    # Every SCF job is journaled, --resume replays what finished last time.
+    #  A daemon always does, its clients can't ask for it when a molecule
+    #  is tuned again after an interrupted or failed run.
+    journal = Journal(arguments["--resume"] or arguments["daemon"])
+
+    # Split the node's cores and memory between concurrent jobs
+    cores = cpu_count() or 1
+    if arguments["--cores"] != "all cores":
+        cores = int(arguments["--cores"])
+    memory = int(0.9 * node_memory())
+    if arguments["--memory"] != "90% of RAM":
+        memory = int(arguments["--memory"])
+    cores_per_job = None
+    if arguments["--cores-per-job"] != "auto":
+        cores_per_job = int(arguments["--cores-per-job"])
+
+    # Daemon, its workers are sized before any molecule shows up and every
+    #  molecule gets an even share of the memory
+    if arguments["daemon"]:
+        cores_per_job = cores_per_job or 1
+        workers = workers or max(cores // cores_per_job, 1)
+
+        def make_runner(tune):
+            plan = make_plan([tune], cores, memory, workers, cores_per_job)
+            return QMRunner(
+                tune,
+                arguments["--executable"],
+                stall=stall,
+                plan=plan,
+                launcher=launcher,
+                scratch=scratch,
+            )
+
+        with JobExecutor(
+            DaemonRunner(),
+            workers,
+            cache,
+            warm_start,
+            journal,
+            pack,
+            arguments["--queue"],
+        ) as executor:
+            print(
+                "Daemon: listening on {0}, {1} workers of {2} cores".format(
+                    socket, workers, cores_per_job
+                ),
+                flush=True,
+            )
+            TuneDaemon(socket, executor, make_runner, priors, journal).serve()
+        journal.close()
+        exit(0)
+
+    # Read input file(s)
+    if arguments["--batch"]:
+        if not exists(arguments["--batch"]):
+            raise Exception(
+                "Input Error: {} doesn't exist, try -h/--help".format(
+                    arguments["--batch"]
+                )
+            )
+        tunes = [read_input(x) for x in read_manifest(arguments["--batch"])]
+        if not tunes:
+            raise Exception(
+                "Input Error: no tuning inputs in {}".format(arguments["--batch"])
+            )
+    else:
+        tunes = [read_input(arguments["--input"])]
+
+    # NWChem jobs only get more than one core when something can start them
+    if cores_per_job is None and not can_launch(launcher, arguments["--executable"]):
+        if any(x.program == ".tune-nw" for x in tunes):
+            cores_per_job = 1
+
+    # An optimize step only ever runs the charge states of one point per
+    #  molecule
+    parallel = None
+    if all(x.tune["step"] == "optimize" for x in tunes):
+        parallel = len(tunes) * int(ceil(3.0 / pack))
+    fraction = None
+    if arguments["--probe"] and cores > 1 and cores_per_job != 1:
+        largest = max(tunes, key=basis_functions)
+        probe = QMRunner(
+            largest,
+            arguments["--executable"],
+            stall=stall,
+            launcher=launcher,
+            scratch=scratch,
+        )
+        fraction, serial, fast = calibrate(probe, cores, memory)
+        print(
+            "Probe: {0:.2f} s on 1 core, {1:.2f} s on {2} cores, parallel fraction {3:.2f}".format(
+                serial, fast, cores, fraction
+            )
+        )
+    plan = make_plan(tunes, cores, memory, workers, cores_per_job, parallel, fraction)
+    print(
+        "Resources: {0.jobs} jobs x {0.cores} cores, {0.memory} MB each, {0.functions} basis functions, parallel fraction {0.fraction:.2f}".format(
+            plan
+        )
+    )
+    workers = plan.jobs
+    runners = [
+        QMRunner(
+            x,
+            arguments["--executable"],
+            stall=stall,
+            plan=plan,
+            launcher=launcher,
+            scratch=scratch,
         )
-    tune = Tune(arguments["--input"])
+        for x in tunes
+    ]
+    runner = runners[0] if len(runners) == 1 else BatchRunner(runners)
+
+    # Molecules like this one tuned before narrow the starting bracket
+    prior = None
+    if priors is not None and not arguments["--batch"] and not arguments["--exhaustive"]:
+        prior = priors.predict(tunes[0])
+    if prior is not None and tunes[0].tune["step"] in ["base", "auto", "optimize"]:
+        print(prior_line(prior))
+
+    # What step do we need to complete, residuals of every point for the fit
+    residuals = {}
+    with JobExecutor(
+        runner, workers, cache, warm_start, journal, pack, arguments["--queue"]
+    ) as executor:
+        if arguments["--batch"]:
+            outcomes = tune_all(tunes, executor, arguments["--exhaustive"], priors)
+        else:
+            points = tune_molecule(
+                tunes[0], executor, arguments["--exhaustive"], residuals, prior
+            )
+    journal.close()
+    if arguments["--resume"]:
+        print("Resumed: {0} SCF jobs replayed".format(journal.replayed()))
+
+    if arguments["--trace"]:
+        write_trace(arguments["--trace"], TRACER.spans)
+    if arguments["--profile"]:
+        print("\n".join(summary(TRACER.spans)))
+
+    if arguments["--batch"]:
+        table = results_table(tunes, outcomes)
+        print("\n".join(table))
+        if arguments["--output"]:
+            with open(arguments["--output"], "w") as f:
+                f.write("\n".join(table) + "\n")
+        exit(0)
 
-    # What step do we need to complete
+    # Every point, the surrogate fit between them and whether the next grid
+    #  step could still improve on it
+    tune = tunes[0]
+    found = estimate(tune, residuals)
+    if priors is not None:
+        priors.record(tune, *optimum(tune, residuals, found))
+    print("\n".join(molecule_report(tune, points, residuals, found)))
 
 
 # Exceptions we may want to handle
 except KeyboardInterrupt:
-    print("Interrupt Detected! exiting...")
+    print("Interrupt Detected! exiting, continue with --resume")
 
 except Exception as e:
     print(e)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""
+    Tune parser -- single pass parser for .tune-nw and .tune-g09 inputs,
+    shared by Tune and TuneInput
+
+    Geometries are stored as a list of atom tags plus a flat array of
+    doubles (x0, y0, z0, x1, ...), which is compact for the thousands of
+    atoms of large conjugated systems. Parsed inputs are also written next
+    to the input as a compiled JSON file, which is loaded instead of
+    re-parsing as long as the input hasn't changed. It is written to a
+    temporary file and moved in place, so concurrent readers never see a
+    partial file, and being JSON a planted one can't run any code.
+"""
+from array import array
+from os import getpid, remove, replace, stat
+from os.path import basename, dirname, join
+import json
+
+# Bump whenever the layout of the parsed dictionary changes
+VERSION = 2
+BLOCKS = ["geometry", "basis", "ecp", "dft", "tune"]
+
+
+def _new():
+    return {
+        "charge": 0,
+        "geometry": {},
+        "basis": {},
+        "ecp": {},
+        "dft": [],
+        "tune": {},
+    }
+
+
+def _open_block(parsed, block):
+    if block == "geometry":
+        parsed["geometry"] = {
+            "symbols": [],
+            "coordinates": array("d"),
+            "extras": {},
+            "option": [],
+        }
+    elif block in ["basis", "ecp"]:
+        parsed[block] = {block: [], "option": []}
+
+
+def _geometry(parsed, line):
+    spl = line.split()
+    geometry = parsed["geometry"]
+    # Check to see if any options are actually specified
+    if spl[0] == "option" and len(spl) <= 1:
+        raise Exception(
+            'Geometry Block Keyword Error: See documentation for "option" keyword'
+        )
+    elif spl[0] == "option":
+        geometry["option"] = spl[1:]
+        return
+    # Check to see if there is actually an atomic vector here
+    try:
+        xyz = [float(x) for x in spl[1:4]]
+    except ValueError:
+        xyz = []
+    if len(xyz) != 3:
+        raise Exception(
+            "Geometry Block Error: Expected atomic vector on line -- {0}".format(line)
+        )
+    if len(spl) > 4:
+        geometry["extras"][len(geometry["symbols"])] = " ".join(spl[4:])
+    geometry["symbols"].append(spl[0])
+    geometry["coordinates"].extend(xyz)
+
+
+def _library(parsed, line, block, label):
+    spl = line.split()
+    if spl[0] == "option" and len(spl) != 2:
+        raise Exception(
+            '{0} Block Keyword Error: See documentation for "option" keyword'.format(
+                label
+            )
+        )
+    elif spl[0] == "option":
+        if spl[1] not in ["global", "specific", "generic"]:
+            raise Exception(
+                "{0} Block Keyword Error: {1} is not an available option, see documentation".format(
+                    label, spl[1]
+                )
+            )
+        parsed[block]["option"] = spl[1]
+    else:
+        parsed[block][block].append(line)
+
+
+def _tune(parsed, line):
+    spl = line.split()
+    if len(spl) != 2:
+        raise Exception(
+            "Tune Block Error: this block can only contain key value pairs, see documentation"
+        )
+    parsed["tune"][spl[0]] = spl[1]
+
+
+# dft: only non standard stuff here, therefore any input check doesn't make sense
+HANDLERS = {
+    "geometry": _geometry,
+    "basis": lambda parsed, line: _library(parsed, line, "basis", "Basis"),
+    "ecp": lambda parsed, line: _library(parsed, line, "ecp", "ECP"),
+    "dft": lambda parsed, line: parsed["dft"].append(line),
+    "tune": _tune,
+}
+
+
+def parse(filename):
+    """
+    Read filename once, line by line. Every line is stripped and
+    lowercased, blank lines and # comments are skipped everywhere.
+    """
+    parsed = _new()
+    block = None
+    with open(filename, "r") as f:
+        for raw in f:
+            line = raw.strip().lower()
+            if line == "" or line[0] == "#":
+                continue
+
+            # inside a block until we find the closing }
+            if block is not None:
+                if line[0] == "}":
+                    block = None
+                else:
+                    HANDLERS[block](parsed, line)
+                continue
+
+            key = line.replace("{", " ").split()[0]
+            if key == "charge":
+                spl = line.split()
+                if len(spl) != 2:
+                    raise Exception(
+                        "Charge Keyword Error: See documentation for charge definition"
+                    )
+                parsed["charge"] = spl[-1]
+            elif key in BLOCKS:
+                block = key
+                _open_block(parsed, block)
+
+    if block is not None:
+        raise Exception(
+            "Input Error: {0} block is missing its closing }}".format(block)
+        )
+    return parsed
+
+
+def geometry_lines(geometry):
+    """
+    Atoms of a parsed geometry as input lines, 'tag x y z [extras]'
+    """
+    xyz = geometry["coordinates"]
+    lines = []
+    for i, symbol in enumerate(geometry["symbols"]):
+        line = "{0:<4} {1:16.10f} {2:16.10f} {3:16.10f}".format(
+            symbol, xyz[3 * i], xyz[3 * i + 1], xyz[3 * i + 2]
+        )
+        if i in geometry["extras"]:
+            line += " " + geometry["extras"][i]
+        lines.append(line)
+    return lines
+
+
+def compiled_path(filename):
+    """
+    Hidden compiled file next to the input, h2o.tune-nw -> .h2o.tune-nw.compiled
+    """
+    return join(dirname(filename), "." + basename(filename) + ".compiled")
+
+
+def load(filename):
+    """
+    Parsed input, from the compiled file when it is up to date with the
+    input, otherwise parse and (re)write the compiled file
+    """
+    source = stat(filename)
+    signature = [VERSION, source.st_mtime_ns, source.st_size]
+    try:
+        with open(compiled_path(filename), "r") as f:
+            compiled = json.load(f)
+        if compiled["signature"] == signature:
+            return _restore(compiled["parsed"])
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        pass
+
+    parsed = parse(filename)
+    path = compiled_path(filename)
+    temporary = "{0}.{1}.tmp".format(path, getpid())
+    try:
+        with open(temporary, "w") as f:
+            json.dump({"signature": signature, "parsed": _plain(parsed)}, f)
+        replace(temporary, path)
+    except OSError:
+        # read only input directory, we just parse every time
+        try:
+            remove(temporary)
+        except OSError:
+            pass
+    return parsed
+
+
+def _plain(parsed):
+    # JSON has neither arrays nor integer keys
+    plain = dict(parsed)
+    geometry = parsed["geometry"]
+    if geometry:
+        plain["geometry"] = dict(
+            geometry,
+            coordinates=geometry["coordinates"].tolist(),
+            extras={str(x): y for x, y in geometry["extras"].items()},
+        )
+    return plain
+
+
+def _restore(plain):
+    geometry = plain["geometry"]
+    if geometry:
+        geometry["coordinates"] = array("d", geometry["coordinates"])
+        geometry["extras"] = {int(x): y for x, y in geometry["extras"].items()}
+    return plain
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+"""
+    Tuning -- jobs for each (alpha, omega) point and the tuning function
+
+        J(alpha, omega) = sqrt( (e_homo(N) + IP(N))^2 + (e_homo(N+1) + IP(N+1))^2 )
+
+    where IP(N) = E(N-1) - E(N), so every point needs three SCF jobs
+"""
+from collections import namedtuple
+from math import ceil, hypot
+
+from analysis import estimate, residual_values
+from optimize import brent
+from tracer import TRACER
+
+# name is Tune.name, charge is the total charge of this electron count
+Job = namedtuple("Job", ["name", "alpha", "omega", "charge"])
+
+
+def point_jobs(tune, alpha, omega):
+    """
+    The N-1, N and N+1 electron jobs for a single point
+    """
+    charge = int(tune.charge)
+    return [
+        Job(tune.name, alpha, omega, charge + 1),
+        Job(tune.name, alpha, omega, charge),
+        Job(tune.name, alpha, omega, charge - 1),
+    ]
+
+
+def scan(tune, executor, points=None, residuals=None):
+    """
+    Evaluate J on points (default: the grid of the current step), all jobs
+    are handed to the executor at once. Returns a list of (alpha, omega, J),
+    the residuals dictionary gets (alpha, omega) -> (r1, r2) of each point
+    (see analysis).
+    """
+    points = tune.grid() if points is None else points
+    jobs = [point_jobs(tune, *p) for p in points]
+    results = executor.run([x for point in jobs for x in point])
+    with TRACER.span("j", points=len(points)):
+        values = residual_values(results, jobs)
+    if residuals is not None:
+        residuals.update(zip(points, map(tuple, values.tolist())))
+    return [(a, w, hypot(*r)) for (a, w), r in zip(points, values.tolist())]
+
+
+def speculative_scan(tune, executor, points=None, residuals=None, start=None):
+    """
+    Evaluate a grid (default: the grid of the current step), but only the
+    points that can still hold the minimum. J is taken to be unimodal in
+    omega along every alpha row of the grid: the row's minimum lies
+    between the evaluated neighbours of its best point, and points outside
+    of that bracket are dropped, killed if they are running. Free workers
+    go to the point farthest from anything evaluated or running in its
+    row, which bisects the bracket, or with a start omega first to the
+    three omegas of each row closest to it. Points already in residuals
+    aren't evaluated again. Returns the evaluated (alpha, omega, J), in
+    grid order.
+
+    When the executor packs jobs, every run started holds the point
+    chosen and its nearest candidates in the row, as many as fill a pack,
+    so packs span omegas, and there are enough runs to fill every worker
+    with a pack.
+    """
+    grid = tune.grid() if points is None else points
+    residuals = {} if residuals is None else residuals
+    rows = {}
+    for alpha, omega in grid:
+        rows.setdefault(alpha, []).append(omega)
+    seeds = set()
+    if start is not None:
+        for alpha, row in rows.items():
+            seeds.update((alpha, x) for x in sorted(row, key=lambda x: abs(x - start))[:3])
+    values = {x: hypot(*residuals[x]) for x in grid if x in residuals}
+    # run handle -> (points, their jobs), enough runs to keep every worker
+    #  busy: a run is one or more points of three jobs each
+    running = {}
+    pack = getattr(executor, "pack", 1)
+    size = max(1, pack // 3)
+    limit = max(1, ceil(executor.workers / ceil(3.0 * size / pack)))
+    interrupted = False
+    try:
+        while True:
+            inside = _bracketed(rows, values)
+            for state, (batch, _) in list(running.items()):
+                if not any(x in inside for x in batch):
+                    executor.cancel(state)
+                    del running[state]
+            busy = {x for batch, _ in running.values() for x in batch}
+            candidates = [x for x in inside if x not in busy]
+            while candidates and len(running) < limit:
+                point = max(
+                    candidates,
+                    key=lambda x: (x in seeds, _distance(rows, values, busy, x)),
+                )
+                row = [x for x in candidates if x[0] == point[0]]
+                batch = sorted(row, key=lambda x: abs(x[1] - point[1]))[:size]
+                for x in batch:
+                    candidates.remove(x)
+                    busy.add(x)
+                jobs = [point_jobs(tune, *x) for x in batch]
+                state = executor.start([x for point in jobs for x in point])
+                running[state] = (batch, jobs)
+            if not running:
+                break
+            for state in executor.wait(list(running)):
+                batch, jobs = running.pop(state)
+                found = residual_values(executor.result(state), jobs).tolist()
+                for point, r in zip(batch, found):
+                    residuals[point] = tuple(r)
+                    values[point] = hypot(*r)
+    except KeyboardInterrupt:
+        interrupted = True
+        raise
+    finally:
+        for state in running:
+            executor.cancel(state, interrupted)
+    return [(a, w, values[(a, w)]) for a, w in grid if (a, w) in values]
+
+
+def _bracketed(rows, values):
+    """
+    Points not evaluated yet that lie inside the bracket of their row
+    """
+    points = []
+    for alpha, row in rows.items():
+        done = [x for x in row if (alpha, x) in values]
+        lower, upper = float("-inf"), float("inf")
+        if done:
+            best = done.index(min(done, key=lambda x: values[(alpha, x)]))
+            if best > 0:
+                lower = done[best - 1]
+            if best < len(done) - 1:
+                upper = done[best + 1]
+        points += [(alpha, x) for x in row if x not in done and lower < x < upper]
+    return points
+
+
+def _distance(rows, values, busy, point):
+    """
+    Distance in omega from point to the nearest evaluated or running point
+    of its row, or to one grid step beyond the ends of the row
+    """
+    alpha, omega = point
+    row = rows[alpha]
+    step = row[1] - row[0] if len(row) > 1 else 1.0
+    others = [row[0] - step, row[-1] + step]
+    others += [x for x in row if (alpha, x) in values or (alpha, x) in busy]
+    return min(abs(omega - x) for x in others)
+
+
+def _spacing(values):
+    values = sorted(set(values))
+    return min([y - x for x, y in zip(values, values[1:])] or [0.0])
+
+
+def grid_scan(tune, executor, grid, exhaustive=False, residuals=None, prior=None):
+    """
+    Evaluate a grid, skipping the points that can't hold the minimum
+    unless exhaustive. A prior (see priors) seeds every alpha row with the
+    omegas closest to its prediction, so a row's bracket usually closes
+    after three points, and in 2D only the rows inside its alpha bracket
+    (at least two steps either way) are evaluated, unless the minimum
+    lands on the first or last of them. Returns the evaluated (alpha,
+    omega, J).
+    """
+    residuals = {} if residuals is None else residuals
+    if exhaustive:
+        missing = [x for x in grid if x not in residuals]
+        if missing:
+            scan(tune, executor, missing, residuals)
+        return [(a, w, hypot(*residuals[(a, w)])) for a, w in grid]
+    if prior is None:
+        return speculative_scan(tune, executor, grid, residuals)
+
+    alphas = [x[0] for x in grid]
+    width = max(prior.alpha_width, 2.0 * _spacing(alphas)) + 1e-9
+    region = [x for x in grid if abs(x[0] - prior.alpha) <= width] or grid
+    points = speculative_scan(tune, executor, region, residuals, prior.omega)
+    inner = [x[0] for x in region]
+    best = min(points, key=lambda x: x[2])[0]
+    if (best == min(inner) and best > min(alphas)) or (
+        best == max(inner) and best < max(alphas)
+    ):
+        points = speculative_scan(tune, executor, grid, residuals, prior.omega)
+    return points
+
+
+def _windowed_brent(f, bounds, center, width, tolerance):
+    """
+    Brent's method on bounds restricted to center +/- width, searched again
+    on the whole of bounds if the minimum hits an edge of the window
+    """
+    lower, upper = bounds
+    if width is not None:
+        lower = max(lower, center - width)
+        upper = min(upper, center + width)
+    best = brent(f, lower, upper, tolerance)[0]
+    edge = min(best - lower, upper - best) < tolerance
+    if width is not None and edge and (lower, upper) != tuple(bounds):
+        best = brent(f, *bounds, tolerance)[0]
+    return best
+
+
+def optimize(tune, executor, residuals=None, prior=None):
+    """
+    Minimize J with Brent's method instead of scanning a grid, 1D tuning
+    searches omega at fixed alpha, 2D tuning alternates between omega and
+    alpha. With a prior the searches start in its bracket. Returns every
+    evaluated (alpha, omega, J), in evaluation order.
+    """
+    points = {}
+
+    def j(alpha, omega):
+        # Gaussian only takes alpha and omega to four decimals, neither do we
+        point = (round(alpha, 4), round(omega, 4))
+        if point not in points:
+            points[point] = scan(tune, executor, [point], residuals)[0][2]
+        return points[point]
+
+    if tune.tune["dimension"] == "1":
+        alpha = float(tune.tune["alpha"])
+        center, width = None, None
+        if prior is not None:
+            center, width = prior.omega, prior.omega_width
+        _windowed_brent(
+            lambda x: j(alpha, x), tune.omega_bounds(), center, width, tune.tolerance()
+        )
+    else:
+        _coordinate_search(tune, j, prior=prior)
+    return [(a, w, x) for (a, w), x in points.items()]
+
+
+def _coordinate_search(tune, j, rounds=10, prior=None):
+    """
+    Alternate 1D Brent searches over omega (alpha fixed) and alpha (omega
+    fixed) until neither moves by more than the tolerance. After the first
+    round (from the start of a prior, in its bracket) each search is
+    restricted to a window around its last minimum, which is widened back
+    to the full bracket if the minimum hits its edge.
+    """
+    tolerance = tune.tolerance()
+    bounds = {"alpha": tune.alpha_bounds(), "omega": tune.omega_bounds()}
+    lower, upper = bounds["alpha"]
+    x = {"alpha": float(tune.tune.get("alpha", 0.5 * (lower + upper))), "omega": None}
+    window = {"alpha": None, "omega": None}
+    if prior is not None:
+        x = {"alpha": prior.alpha, "omega": prior.omega}
+        window = {"alpha": prior.alpha_width, "omega": prior.omega_width}
+
+    def search(name, f):
+        return _windowed_brent(f, bounds[name], x[name], window[name], tolerance)
+
+    for _ in range(rounds):
+        previous = dict(x)
+        x["omega"] = search("omega", lambda w: j(x["alpha"], w))
+        x["alpha"] = search("alpha", lambda a: j(a, x["omega"]))
+        shift = max(abs(x[k] - previous[k]) for k in x if previous[k] is not None)
+        if previous["omega"] is not None and shift < tolerance:
+            break
+        width = max(10.0 * tolerance, 2.0 * shift)
+        window = {"alpha": width, "omega": width}
+
+
+def next_step(tune, step, found):
+    """
+    The grid step that should follow step, None once the surrogate optimum
+    found (an analysis.Estimate, None if the fit failed) is already known
+    to within half the spacing of that step's grid: it couldn't tell us
+    anything better.
+    """
+    steps = ["base", "coarse", "fine"]
+    if tune.tune["dimension"] == "2":
+        steps = ["base", "coarse"]
+    if step not in steps or step == steps[-1]:
+        return None
+    following = steps[steps.index(step) + 1]
+    if found is None:
+        return following
+    alpha_spacing, omega_spacing = tune.spacing(following)
+    if (
+        found.omega_error <= 0.5 * omega_spacing
+        and found.alpha_error <= 0.5 * alpha_spacing + 1e-12
+    ):
+        return None
+    return following
+
+
+def auto_tune(tune, executor, exhaustive=False, residuals=None, prior=None):
+    """
+    Run the grid steps one after the other, each centered on the surrogate
+    optimum of the points so far (the best point if the fit fails), and
+    stop as soon as next_step says the following step isn't needed. A
+    prior narrows the base step. Returns every evaluated (alpha, omega, J).
+    """
+    residuals = {} if residuals is None else residuals
+    step = "base"
+    alpha = omega = None
+    while step is not None:
+        grid = tune.grid(step, alpha, omega)
+        grid_scan(
+            tune, executor, grid, exhaustive, residuals, prior if step == "base" else None
+        )
+        found = estimate(tune, residuals)
+        alpha, omega = optimum(tune, residuals, found)
+        step = next_step(tune, step, found)
+    return [(a, w, hypot(*r)) for (a, w), r in residuals.items()]
+
+
+def optimum(tune, residuals, found=None):
+    """
+    (alpha, omega) of the surrogate optimum found (see analysis.estimate),
+    of the best evaluated point if the fit failed
+    """
+    if found is not None:
+        return found.alpha, found.omega
+    return min(residuals, key=lambda x: hypot(*residuals[x]))
+
+
+def tune_molecule(tune, executor, exhaustive=False, residuals=None, prior=None):
+    """
+    Complete the step requested in the tune block, grid steps skip the
+    points that can't hold the minimum unless exhaustive. The residuals of
+    every evaluated point are added to residuals, for analysis.estimate.
+    A prior (see priors) narrows the base grid and the optimize step, it
+    is ignored when exhaustive. Once the step is complete the executor's
+    journal, if any, is settled (see Journal.settle).
+    """
+    if exhaustive:
+        prior = None
+    if tune.tune["step"] == "optimize":
+        points = optimize(tune, executor, residuals, prior)
+    elif tune.tune["step"] == "auto":
+        points = auto_tune(tune, executor, exhaustive, residuals, prior)
+    else:
+        if tune.tune["step"] != "base":
+            prior = None
+        points = grid_scan(tune, executor, tune.grid(), exhaustive, residuals, prior)
+    # the molecule is tuned, nothing of its journal is left to resume
+    journal = getattr(executor, "journal", None)
+    if journal is not None:
+        journal.settle(tune.name)
+    return points
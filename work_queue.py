@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+"""
+    Work queue -- runs the jobs of a JobExecutor on worker processes of
+    any node that can open the queue file
+
+    The coordinator (tune-it.py --queue) publishes every SCF job into an
+    SQLite file, tune-it.py worker processes claim them with a lease, run
+    them and post the results back. A worker renews the lease while its
+    job runs, when a node dies its leases expire and the jobs are handed
+    to the next worker that asks, up to ATTEMPTS times. Nothing but the
+    file is shared: no scheduler, no network service. The file has to be
+    on a filesystem with working locks (a local disk for workers on the
+    same machine, or a shared filesystem that supports POSIX locks).
+
+    Several coordinators may share a queue file, each with a session of
+    its own that it keeps alive like a lease. A worker joins the session
+    of the first task it claims and only runs tasks of that session until
+    it is closed, or expires because its coordinator died.
+
+    Payloads and results are pickled, so workers must run the same
+    version of tune-it.py as the coordinator.
+"""
+from concurrent.futures import Future
+from os import getpid, makedirs
+from os.path import dirname, expanduser
+from socket import gethostname
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+
+# Seconds a claim is valid without renewal, seconds between renewals (and
+#  checks for cancellation) and claims before a job is given up on
+LEASE = 60.0
+RENEW = 5.0
+ATTEMPTS = 3
+
+
+class WorkQueue:
+    """
+    SQLite tables shared by the coordinators and the workers. A session
+    is one coordinator run, its setup is the pickled (initializer,
+    initargs, terminate) every worker applies before running the session's
+    jobs, and it expires unless renewed within LEASE seconds. Tasks go
+    queued -> claimed -> done, or cancelled. The coordinator removes tasks
+    as it collects them.
+    """
+
+    def __init__(self, path):
+        self.path = expanduser(path)
+        if dirname(self.path):
+            makedirs(dirname(self.path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            self.path, timeout=60.0, isolation_level=None, check_same_thread=False
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session TEXT PRIMARY KEY, "
+            + "setup BLOB NOT NULL, closed INTEGER NOT NULL, created REAL NOT NULL, "
+            + "renewed REAL NOT NULL)"
+        )
+        columns = [x[1] for x in self.db.execute("PRAGMA table_info(sessions)")]
+        if "renewed" not in columns:
+            # queue file of an earlier tune-it.py, its sessions count as expired
+            try:
+                self.db.execute(
+                    "ALTER TABLE sessions ADD COLUMN renewed REAL NOT NULL DEFAULT 0"
+                )
+            except sqlite3.OperationalError:
+                # another process got there first
+                pass
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY, "
+            + "session TEXT NOT NULL, payload BLOB NOT NULL, state TEXT NOT NULL, "
+            + "worker TEXT, lease REAL, attempts INTEGER NOT NULL, "
+            + "cancel INTEGER NOT NULL, result BLOB)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state)")
+
+    def _transaction(self, statements):
+        """
+        Run (sql, parameters) pairs under one write lock, returns the cursor
+        of the last one
+        """
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, parameters in statements:
+                    cursor = self.db.execute(sql, parameters)
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return cursor
+
+    # Coordinator side
+
+    def open_session(self, setup):
+        """
+        Start a new session, closed and expired sessions are dropped along
+        with their tasks
+        """
+        session = uuid.uuid4().hex
+        now = time.time()
+        over = "closed = 1 OR renewed < ?"
+        self._transaction(
+            [
+                (
+                    "DELETE FROM tasks WHERE session IN "
+                    + "(SELECT session FROM sessions WHERE "
+                    + over
+                    + ")",
+                    (now - LEASE,),
+                ),
+                ("DELETE FROM sessions WHERE " + over, (now - LEASE,)),
+                (
+                    "INSERT INTO sessions VALUES (?, ?, 0, ?, ?)",
+                    (session, pickle.dumps(setup), now, now),
+                ),
+            ]
+        )
+        return session
+
+    def renew_session(self, session):
+        self._transaction(
+            [
+                (
+                    "UPDATE sessions SET renewed = ? WHERE session = ?",
+                    (time.time(), session),
+                )
+            ]
+        )
+
+    def close_session(self, session):
+        self._transaction(
+            [
+                (
+                    "UPDATE tasks SET state = 'cancelled' WHERE session = ? "
+                    + "AND state = 'queued'",
+                    (session,),
+                ),
+                (
+                    "UPDATE tasks SET cancel = 1 WHERE session = ? "
+                    + "AND state = 'claimed'",
+                    (session,),
+                ),
+                ("UPDATE sessions SET closed = 1 WHERE session = ?", (session,)),
+            ]
+        )
+
+    def publish(self, session, payload):
+        cursor = self._transaction(
+            [
+                (
+                    "INSERT INTO tasks (session, payload, state, attempts, cancel) "
+                    + "VALUES (?, ?, 'queued', 0, 0)",
+                    (session, payload),
+                )
+            ]
+        )
+        return cursor.lastrowid
+
+    def cancel(self, task):
+        """
+        Drop a queued task, True if it hadn't been claimed yet. A claimed
+        task is flagged, its worker terminates it at the next renewal.
+        """
+        cursor = self._transaction(
+            [
+                (
+                    "UPDATE tasks SET state = 'cancelled' WHERE id = ? "
+                    + "AND state = 'queued'",
+                    (task,),
+                )
+            ]
+        )
+        if cursor.rowcount:
+            return True
+        self._transaction([("UPDATE tasks SET cancel = 1 WHERE id = ?", (task,))])
+        return False
+
+    def collect(self, session):
+        """
+        Results of the finished tasks, as a list of (id, result), and the
+        ids of tasks whose leases ran out ATTEMPTS times. Both are removed
+        from the queue.
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                done = self.db.execute(
+                    "SELECT id, result FROM tasks WHERE session = ? AND state = 'done'",
+                    (session,),
+                ).fetchall()
+                lost = self.db.execute(
+                    "SELECT id FROM tasks WHERE session = ? AND state = 'claimed' "
+                    + "AND lease < ? AND attempts >= ?",
+                    (session, now, ATTEMPTS),
+                ).fetchall()
+                self.db.executemany(
+                    "DELETE FROM tasks WHERE id = ?", [(x[0],) for x in done + lost]
+                )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return done, [x[0] for x in lost]
+
+    # Worker side
+
+    def claim(self, worker, lease=LEASE, session=None):
+        """
+        Lease the oldest queued task, or one whose lease has expired, of
+        session (any live one by default) to worker. Returns (id, session,
+        payload) or None.
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    "SELECT tasks.id, tasks.session, tasks.payload FROM tasks "
+                    + "JOIN sessions ON tasks.session = sessions.session "
+                    + "WHERE sessions.closed = 0 AND sessions.renewed >= ? "
+                    + "AND (? IS NULL OR sessions.session = ?) "
+                    + "AND (tasks.state = 'queued' OR "
+                    + "(tasks.state = 'claimed' AND tasks.lease < ? "
+                    + "AND tasks.attempts < ?)) ORDER BY tasks.id LIMIT 1",
+                    (now - LEASE, session, session, now, ATTEMPTS),
+                ).fetchone()
+                if row is not None:
+                    self.db.execute(
+                        "UPDATE tasks SET state = 'claimed', worker = ?, lease = ?, "
+                        + "attempts = attempts + 1 WHERE id = ?",
+                        (worker, now + lease, row[0]),
+                    )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return row
+
+    def renew(self, task, worker, lease=LEASE):
+        """
+        Extend the lease of a running task, False once the worker should
+        stop it: cancelled, or re-issued to another worker
+        """
+        cursor = self._transaction(
+            [
+                (
+                    "UPDATE tasks SET lease = ? WHERE id = ? AND worker = ? "
+                    + "AND state = 'claimed' AND cancel = 0",
+                    (time.time() + lease, task, worker),
+                )
+            ]
+        )
+        return cursor.rowcount == 1
+
+    def post(self, task, worker, result):
+        """
+        Store the result of a task, unless it was cancelled or re-issued
+        to another worker in the meantime
+        """
+        self._transaction(
+            [
+                (
+                    "UPDATE tasks SET state = 'done', result = ? WHERE id = ? "
+                    + "AND worker = ? AND state = 'claimed'",
+                    (result, task, worker),
+                )
+            ]
+        )
+
+    def setup(self, session):
+        row = self.db.execute(
+            "SELECT setup FROM sessions WHERE session = ?", (session,)
+        ).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def closed(self, session=None):
+        """
+        True once session has ended: closed, expired or dropped. Without a
+        session, once every session has (and there was one).
+        """
+        if session is None:
+            rows = self.db.execute("SELECT closed, renewed FROM sessions").fetchall()
+        else:
+            rows = self.db.execute(
+                "SELECT closed, renewed FROM sessions WHERE session = ?", (session,)
+            ).fetchall()
+            if not rows:
+                return True
+        expired = time.time() - LEASE
+        return bool(rows) and all(x[0] == 1 or x[1] < expired for x in rows)
+
+    def close(self):
+        self.db.close()
+
+
+class _QueueFuture(Future):
+    """
+    Future of a published task, cancelling it also drops the task or flags
+    it for its worker
+    """
+
+    def __init__(self, pool, task):
+        super().__init__()
+        self.pool = pool
+        self.task = task
+
+    def cancel(self):
+        if self.done():
+            return super().cancel()
+        if not self.pool.queue.cancel(self.task):
+            return False
+        with self.pool.lock:
+            self.pool.futures.pop(self.task, None)
+        return super().cancel()
+
+
+class QueuePool:
+    """
+    Drop-in for the ProcessPoolExecutor of a JobExecutor that publishes
+    every submitted call into the work queue at path instead. Workers call
+    initializer(*initargs) once per session, and terminate(*args) to stop
+    a running call that was cancelled. A poller thread hands the results
+    back to the futures every poll seconds, and renews the session.
+    """
+
+    def __init__(self, path, initializer, initargs=(), terminate=None, poll=0.2):
+        self.queue = WorkQueue(path)
+        self.session = self.queue.open_session((initializer, initargs, terminate))
+        self.poll = poll
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.stopped = threading.Event()
+        self.poller = threading.Thread(target=self._poller, daemon=True)
+        self.poller.start()
+
+    def submit(self, fn, *args):
+        task = self.queue.publish(self.session, pickle.dumps((fn, args)))
+        future = _QueueFuture(self, task)
+        with self.lock:
+            self.futures[task] = future
+        return future
+
+    def _poller(self):
+        renewed = time.time()
+        while not self.stopped.wait(self.poll):
+            if time.time() - renewed > RENEW:
+                self.queue.renew_session(self.session)
+                renewed = time.time()
+            done, lost = self.queue.collect(self.session)
+            with self.lock:
+                finished = [(self.futures.pop(x, None), y) for x, y in done]
+                gone = [(self.futures.pop(x, None), x) for x in lost]
+            # outside the lock, the callbacks submit the next jobs
+            for future, result in finished:
+                if future is None:
+                    continue
+                ok, value = pickle.loads(result)
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            for future, task in gone:
+                if future is not None:
+                    future.set_exception(
+                        Exception(
+                            "Queue Error: task {0} lost by {1} workers in a row".format(
+                                task, ATTEMPTS
+                            )
+                        )
+                    )
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """
+        End the session: queued tasks are dropped and running ones
+        terminated by their workers
+        """
+        self.queue.close_session(self.session)
+        with self.lock:
+            futures = list(self.futures.values())
+            self.futures = {}
+        for future in futures:
+            if not future.done():
+                Future.cancel(future)
+        # the poller has to be done with the queue before it is closed
+        self.stopped.set()
+        self.poller.join()
+        self.queue.close()
+
+
+def _renewer(queue, task, worker, lease, interval, stop, terminate, args):
+    """
+    Keep the lease of a running task, terminate it once the coordinator
+    cancels it or the lease is lost
+    """
+    while not stop.wait(interval):
+        if not queue.renew(task, worker, lease):
+            if terminate is not None:
+                terminate(*args)
+            return
+
+
+def work(path, idle=None, poll=0.2, lease=LEASE):
+    """
+    Worker loop, claim a task, run it and post its result until the
+    session of the first task claimed is over, or idle seconds passed
+    without a task. Returns the number of tasks run.
+    """
+    queue = WorkQueue(path)
+    worker = "{0}:{1}".format(gethostname(), getpid())
+    interval = min(RENEW, lease / 3.0)
+    session = None
+    terminate = None
+    count = 0
+    last = time.time()
+    try:
+        while True:
+            claimed = queue.claim(worker, lease, session)
+            if claimed is None:
+                if queue.closed(session) or (
+                    idle is not None and time.time() - last > idle
+                ):
+                    return count
+                time.sleep(poll)
+                continue
+            task, task_session, payload = claimed
+            if session is None:
+                setup = queue.setup(task_session)
+                if setup is None:
+                    continue
+                initializer, initargs, terminate = setup
+                initializer(*initargs)
+                session = task_session
+
+            fn, args = pickle.loads(payload)
+            stop = threading.Event()
+            renewer = threading.Thread(
+                target=_renewer,
+                args=(queue, task, worker, lease, interval, stop, terminate, args),
+                daemon=True,
+            )
+            renewer.start()
+            try:
+                outcome = (True, fn(*args))
+            except Exception as e:
+                outcome = (False, e)
+            finally:
+                stop.set()
+                renewer.join()
+            try:
+                result = pickle.dumps(outcome)
+            except Exception as e:
+                if outcome[0]:
+                    error = "Queue Error: result of task {0} can't be pickled: {1}"
+                    outcome = (False, Exception(error.format(task, e)))
+                else:
+                    outcome = (False, Exception(str(outcome[1])))
+                result = pickle.dumps(outcome)
+            queue.post(task, worker, result)
+            count += 1
+            last = time.time()
+    finally:
+        queue.close()